@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Micro-benchmarks for the hot paths of a crawl, without network access.
+
+Each configured site in sites.py has recorded HTML fixtures in `bench-fixtures/`: a
+listing page (`<slug>.listing.html`) and, for sites with `expose-details`, an exposé
+page (`<slug>.expose.html`). Fixtures are padded with `filler.html` at their
+`<!-- filler -->` markers up to a realistic page size.
+
+Measured stages are:
+
+    known-store/<n>   lookups in a known store of n entries
+    known-file/<n>    the same lookups in a legacy known.txt file, for comparison
+    fingerprint/<site>          text fingerprint of a listing without success-str
+    expose-urls/<site>          finding exposé links (and listing-details) on a listing
+                                page
+    expose-details/<site>       extracting details from an exposé page
+    startup/<command>           running `crawler.py <command>` in a new interpreter
+    startup/site-registry       loading and compiling the sites in sites.py
+
+For each stage the best and median wall time of a number of repeats and the peak
+memory allocated during one run are reported. Results are appended to
+`bench-results.jsonl` along with the current git commit, and compared to the previous
+result of each stage, so regressions between commits are visible.
+
+Run `bench.py --help` for options.
+"""
+import re
+import sys
+import json
+import time
+import runpy
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import unicodedata
+from pathlib import Path
+from argparse import ArgumentParser
+import extract
+import known
+from sites import sites as site_configs
+
+FIXTURES_PATH = Path(__file__).parent / "bench-fixtures"
+RESULTS_FILE = Path(__file__).parent / "bench-results.jsonl"
+FILLER_MARKER = "<!-- filler -->"
+PAGE_SIZE = 200 * 1024  # bytes to pad fixtures to
+REPEAT = 20
+KNOWN_SIZES = [1000, 10000, 100000]
+KNOWN_LOOKUPS = 100
+CRAWLER = Path(__file__).parent / "crawler.py"
+STARTUP_COMMANDS = ["service", "timer", "stats"]
+
+LOG_MISSING_FIXTURE = "WARNING: no fixture {} for {}"
+TABLE_HEADER = "{: <60} {: >10} {: >10} {: >10} {: >8}".format(
+    "stage", "best ms", "median ms", "peak KiB", "change"
+)
+TABLE_ROW = "{: <60} {: >10.3f} {: >10.3f} {: >10.1f} {: >8}"
+
+
+def slug(name):
+    """Return the fixture file name prefix of a site *name*."""
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def load_fixture(name, kind, size=PAGE_SIZE):
+    """
+    Return the *kind* ("listing" or "expose") fixture of site *name*, padded to about
+    *size* bytes, or None if there is no such fixture.
+    """
+    path = FIXTURES_PATH / f"{slug(name)}.{kind}.html"
+    try:
+        html = path.read_text()
+    except FileNotFoundError:
+        return None
+    filler = (FIXTURES_PATH / "filler.html").read_text()
+    markers = html.count(FILLER_MARKER)
+    if markers:
+        copies = max(0, size - len(html)) // (len(filler) * markers)
+        html = html.replace(FILLER_MARKER, filler * copies)
+    return html
+
+
+def measure(func, repeat=REPEAT):
+    """
+    Run *func* *repeat* times after a warm-up run, and once more while tracing memory
+    allocations. Returns a dict of the best and median time in seconds and the peak
+    allocated bytes.
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best": min(times), "median": statistics.median(times), "peak": peak}
+
+
+def known_stages(tmp_path):
+    """Yield (stage, func) for known store and known file lookups of growing size."""
+    for size in KNOWN_SIZES:
+        keys = [f"https://www.example.com/expose/{i}" for i in range(size)]
+        lookups = keys[:: max(1, size // KNOWN_LOOKUPS)][: KNOWN_LOOKUPS // 2] + [
+            f"https://www.example.com/new/{i}" for i in range(KNOWN_LOOKUPS // 2)
+        ]
+
+        known_file_path = tmp_path / f"known-{size}.txt"
+        known_file_path.write_text("\n".join(keys) + "\n")
+        store = known.KnownStore(tmp_path / f"known-{size}.db")
+        store.import_file(known_file_path)
+
+        def store_lookups(store=store, lookups=lookups):
+            for key in lookups:
+                key in store
+
+        def file_lookups(path=known_file_path, lookups=lookups):
+            for key in lookups:
+                with path.open() as known_file:
+                    any(True for line in known_file if key in line)
+
+        yield f"known-store/{size}", store_lookups
+        yield f"known-file/{size}", file_lookups
+
+
+def site_stages(size):
+    """Yield (stage, func) for the fingerprint and extraction stages of each site."""
+    for config in site_configs:
+        name = config["name"]
+        plan = extract.ExtractionPlan(config)
+        listing = load_fixture(name, "listing", size)
+        if listing is None:
+            print(LOG_MISSING_FIXTURE.format("listing", name), file=sys.stderr)
+            continue
+        if config.get("success-str") is None:
+            yield f"fingerprint/{name}", lambda plan=plan, html=listing: (
+                plan.fingerprint(html)
+            )
+        elif plan.expose_urls is not None:
+            yield f"expose-urls/{name}", lambda plan=plan, html=listing: (
+                plan.find_listing_entries(html)
+            )
+        if plan.details is not None:
+            expose = load_fixture(name, "expose", size)
+            if expose is None:
+                print(LOG_MISSING_FIXTURE.format("expose", name), file=sys.stderr)
+                continue
+            yield f"expose-details/{name}", lambda plan=plan, html=expose: (
+                plan.details.extract(html)
+            )
+
+
+def startup_stages(tmp_path):
+    """
+    Yield (stage, func) for the startup time of short crawler commands, run in
+    *tmp_path* so that they don't touch the databases of a real crawl, and for building
+    the site registry (without the `re` module's cache of compiled patterns).
+    """
+    for command in STARTUP_COMMANDS:
+        yield f"startup/{command}", lambda command=command: subprocess.run(
+            [sys.executable, str(CRAWLER), command],
+            cwd=tmp_path,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def site_registry():
+        re.purge()
+        sites = runpy.run_path(str(Path(__file__).parent / "sites.py"))["sites"]
+        extract.compile_plans(sites)
+
+    yield "startup/site-registry", site_registry
+
+
+def git_commit():
+    """Return the current git commit hash, or None outside of a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results():
+    """Return the last recorded result of each stage from RESULTS_FILE."""
+    previous = {}
+    try:
+        with RESULTS_FILE.open() as results_file:
+            for line in results_file:
+                previous.update(json.loads(line)["stages"])
+    except FileNotFoundError:
+        pass
+    return previous
+
+
+def format_change(result, previous):
+    if previous is None or not previous["best"]:
+        return ""
+    return "{:+.0%}".format(result["best"] / previous["best"] - 1)
+
+
+def main(options):
+    previous = previous_results()
+    results = {}
+    print(TABLE_HEADER)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stages = [
+            *known_stages(Path(tmp_dir)),
+            *site_stages(options.size),
+            *startup_stages(Path(tmp_dir)),
+        ]
+        for stage, func in stages:
+            if options.filter and not re.search(options.filter, stage):
+                continue
+            result = measure(func, options.repeat)
+            results[stage] = result
+            print(
+                TABLE_ROW.format(
+                    stage[:60],
+                    result["best"] * 1000,
+                    result["median"] * 1000,
+                    result["peak"] / 1024,
+                    format_change(result, previous.get(stage)),
+                )
+            )
+    if options.save:
+        record = {
+            "commit": git_commit(),
+            "time": time.time(),
+            "python": sys.version.split()[0],
+            "page_size": options.size,
+            "stages": results,
+        }
+        with RESULTS_FILE.open("a") as results_file:
+            print(json.dumps(record), file=results_file)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the hot paths of a crawl.")
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=REPEAT,
+        help=f"Repeat each stage n times (default {REPEAT})",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=PAGE_SIZE,
+        help=f"Pad fixtures to about this many bytes (default {PAGE_SIZE})",
+    )
+    parser.add_argument(
+        "-k", "--filter", help="Only run stages matching this regular expression"
+    )
+    parser.add_argument(
+        "--no-save",
+        dest="save",
+        action="store_false",
+        help=f"Don't append the results to {RESULTS_FILE.name}",
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,200 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Persistent caches that save the crawler from downloading or parsing unchanged pages.
+
+`ValidatorCache` remembers the HTTP validators (`ETag` and `Last-Modified`) of each
+listing page, so that the next request can be made conditional. A server answering
+"304 Not Modified" has nothing new to show. For servers that don't support validators,
+a digest of the last body is compared instead.
+
+>>> cache = ValidatorCache("cache.db")
+>>> response = client.get(url, headers=cache.request_headers(url))
+>>> if not cache.unchanged(url, response, response.content):
+...     parse(response.text)
+...     cache.update(url, response, response.content)
+
+`DetailsCache` keeps the details extracted from each exposé, as exposés hardly ever
+change. Entries expire after *ttl* seconds, and only the newest *max_entries* are kept:
+
+>>> details_cache = DetailsCache("details.db", ttl=7 * 24 * 60 * 60)
+>>> details_cache.get(url, plan.key)
+>>> details_cache.put(url, plan.key, {"title": "Wohnung 1", "rooms": "2"})
+>>> details_cache.get(url, plan.key)
+{'title': 'Wohnung 1', 'rooms': '2'}
+"""
+import json
+import time
+import sqlite3
+import threading
+from hashlib import sha1
+
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+DETAILS_TTL = 7 * 24 * 60 * 60
+DETAILS_MAX_ENTRIES = 10000
+
+
+class ValidatorCache:
+    """
+    Per-url HTTP validators and body digests, persisted to the SQLite database at
+    *path*. Counts `hits` (unchanged pages) and `misses` (changed or unknown pages).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS validators"
+                " (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT)"
+            )
+
+    def _get(self, url):
+        with self.lock:
+            return self.db.execute(
+                "SELECT etag, last_modified, digest FROM validators WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+    def request_headers(self, url):
+        """Return the conditional request headers for *url*, if any are known."""
+        row = self._get(url)
+        headers = {}
+        if row:
+            etag, last_modified, _ = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def unchanged(self, url, response, content):
+        """
+        Return True if *response* shows that *url* hasn't changed since the last
+        `update()`, either by a 304 status, or by an identical digest of the body
+        *content*. If *content* is None (e.g. a partially read stream), only the status
+        counts.
+        """
+        if response.status_code == 304:
+            unchanged = True
+        elif not response.ok or content is None:
+            unchanged = False
+        else:
+            row = self._get(url)
+            unchanged = row is not None and row[2] == digest(content)
+        with self.lock:
+            if unchanged:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return unchanged
+
+    def update(self, url, response, content):
+        """
+        Remember the validators of a successful *response*, and the digest of its body
+        *content*, if given.
+        """
+        if response.status_code == 304 or not response.ok:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)",
+                (
+                    url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    digest(content) if content is not None else None,
+                ),
+            )
+
+    def close(self):
+        self.db.close()
+
+
+class DetailsCache:
+    """
+    The details extracted from each exposé url, persisted to the SQLite
+    database at *path*. Entries are only valid for the same patterns (their *key*, see
+    :py:class:`extract.DetailsPlan`), and for *ttl* seconds. `expire()` deletes expired
+    entries, and all but the newest *max_entries*. Counts `hits` and `misses`. *clock*
+    defaults to `time.time()`.
+    """
+
+    def __init__(
+        self, path, ttl=DETAILS_TTL, max_entries=DETAILS_MAX_ENTRIES, clock=time.time
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS details (url TEXT PRIMARY KEY,"
+                " key TEXT, details TEXT, stored REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS details_stored ON details (stored)"
+            )
+
+    def get(self, url, key):
+        """
+        Return the details dict of *url* if it was stored with the same *key* and
+        hasn't expired yet, else None.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT details FROM details"
+                " WHERE url = ? AND key = ? AND stored > ?",
+                (url, key, self.clock() - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, url, key, details):
+        """Store the *details* dict of *url*, extracted with the patterns *key*."""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO details VALUES (?, ?, ?, ?)",
+                (url, key, json.dumps(details), self.clock()),
+            )
+
+    def expire(self):
+        """
+        Delete expired entries, and the oldest ones beyond `max_entries`. Returns the
+        number of deleted entries.
+        """
+        with self.lock, self.db:
+            deleted = self.db.execute(
+                "DELETE FROM details WHERE stored <= ?", (self.clock() - self.ttl,)
+            ).rowcount
+            deleted += self.db.execute(
+                "DELETE FROM details WHERE url NOT IN"
+                " (SELECT url FROM details ORDER BY stored DESC LIMIT ?)",
+                (self.max_entries,),
+            ).rowcount
+        return deleted
+
+    def close(self):
+        self.db.close()
+
+
+def digest(content):
+    """Return a hex digest of the bytes *content*."""
+    return sha1(content).hexdigest()
@@ -14,7 +14,16 @@ found. Will optionally retrieve the offer links as well scan them for additional
 on the offer.
 
 Previously seen offers will not be considered and to that end all offer links will be
-saved to a `known.txt` file.
+saved to a `known.db` database (see known.py).
+
+To crawl for several flat-seekers at once, put a config file for each of them in the
+`profiles/` directory (see profiles.py). Sites are expanded for each profile, but pages
+shared by several profiles are only retrieved once, and each profile gets its own known
+offers and emails.
+
+To spread a crawl over several processes, run it with `--workers N`: sites are split
+into N shards by host, which are checked by N worker processes (see workers.py). More
+workers can join from other machines with `crawler.py worker`.
 
 If there are any new offers, format the collected offer list as a plaintext email with
 links. When run with the flag `--no-email`, skip email sending and print the text on
@@ -23,34 +32,112 @@ stdout. Use this flag to send via other means, such as messenger bots.
 import re
 import os
 import sys
+import copy
 import time
+import heapq
+import threading
+import importlib.util
 from collections import defaultdict
-from urllib.parse import urlparse, urlsplit, urlunparse
-from hashlib import sha1
+from urllib.parse import urljoin, urlparse, urlsplit, urlunparse
 from pathlib import Path
 from argparse import ArgumentParser
-from bs4 import BeautifulSoup
-import requests
-import sendmail
-from sites import sites as site_configs
+import config
+import profiling
 from config import MailConfig
 
+
+def lazy_import(name):
+    """
+    Return the module *name*, which is only loaded once one of its attributes is used.
+    Keeps short runs like printing a unit file from loading the HTTP and email stack.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+futures = lazy_import("concurrent.futures")
+socket = lazy_import("socket")
+statistics = lazy_import("statistics")
+subprocess = lazy_import("subprocess")
+requests = lazy_import("requests")
+cache = lazy_import("cache")
+extract = lazy_import("extract")
+fetch = lazy_import("fetch")
+filters = lazy_import("filters")
+known = lazy_import("known")
+notify = lazy_import("notify")
+profiles = lazy_import("profiles")
+retry = lazy_import("retry")
+scheduler = lazy_import("scheduler")
+sendmail = lazy_import("sendmail")
+snapshots = lazy_import("snapshots")
+workers = lazy_import("workers")
+
 seconds = 1
 minutes = 60 * seconds
 hours = 60 * minutes
+days = 24 * hours
 
 
 ### Basic settings
 RECIPIENTS = [MailConfig.recipient, *MailConfig.bcc_recipients]
 CHECK_INTERVAL = 1 * hours
+DAEMON_JITTER = 0.25  # shift each check in daemon mode by up to 25% of its interval
+ADAPTIVE_INTERVALS = True  # adapt intervals in daemon mode to how often sites change
+MIN_INTERVAL = 5 * minutes  # adaptive interval bounds, can be overridden per site
+MAX_INTERVAL = 6 * hours
+CHANGE_BOOST = 1 * hours  # check at MIN_INTERVAL for this long after a change
+CHANGE_HISTORY_DB = "history.db"
+SNAPSHOTS_PATH = "snapshots"  # archive of all retrieved pages, for --replay
+SNAPSHOTS_KEEP = 500  # number of crawls to keep in the archive, 0 disables it
 URL_PRINT_LENGTH = 300  # print at maximimum n chars of the url in error messages
-KNOWN_FILE = "known.txt"
+KNOWN_DB = "known.db"  # for profiles, known-<profile>.db
+KNOWN_FILE = "known.txt"  # legacy known list, imported into KNOWN_DB once
+KNOWN_RETENTION = 90 * days  # forget offers that disappeared (or went unseen) this long
+VALIDATOR_CACHE_DB = "cache.db"
+DETAILS_CACHE_DB = "details.db"  # details of retrieved exposés, reused until expired
+DETAILS_CACHE_TTL = 7 * days
+DETAILS_CACHE_SIZE = 10000  # exposés kept in DETAILS_CACHE_DB
+OUTBOX_PATH = "outbox"  # emails that weren't sent yet, sent in the background
+MAIL_WINDOW = 60  # send at most one email per n seconds, with all offers found so far
+FILTER_OFFERS = True  # skip offers that don't match the criteria in config.py
+PROFILES_PATH = "profiles"  # a config file per flat-seeker, instead of config.py
+MAX_CONCURRENT_SITES = 8  # how many sites are checked at the same time
+MAX_PAGES = 5  # listing pages checked per site, unless set in its max-pages
+MAX_CONCURRENT_PAGES = 4  # listing pages of a site retrieved at the same time
+RUN_DEADLINE = 15 * minutes  # give up on sites not checked by then, None for no limit
+RETRIES = 2  # retries of a site within a run, after errors in RETRY_ERRORS
+RETRY_ERRORS = {"dns", "connect", "timeout", "server"}  # error kinds, see retry.py
+RETRY_BACKOFF = 2 * seconds  # before the first retry, 3 times longer before each next
+BREAKER_DB = "breakers.db"  # sites that failed in several runs in a row
+BREAKER_FAILURES = 3  # skip a site after it failed to respond in n runs in a row
+BREAKER_COOLDOWN = 1 * hours  # before trying it again, doubled after each failed try
+BREAKER_MAX_COOLDOWN = 1 * days
+WORK_QUEUE_DB = "work.db"  # shards of crawls with --workers, see workers.py
+WORKER_POLL = 1 * seconds  # how often workers look for shards, and results are read
+WORKER_TASK_TIMEOUT = 30 * minutes  # hand shards to another worker after this long
 
 ### HTTP request settings
 HEADERS = {
     # set a user agent to prevent "403: forbidden" errors on some sites
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:74.0) Gecko/20100101 Firefox/74.0"
 }
+POOL_CONNECTIONS = 32  # number of hosts to keep alive connections for
+POOL_MAXSIZE = MAX_CONCURRENT_SITES  # alive connections per host
+STREAM_LISTINGS = True  # stop reading listings once clear, see "stream" in sites.py
+MAX_REQUESTS_PER_HOST = 4  # requests sent to one host at the same time
+REQUESTS_PER_SECOND = 2  # average requests per second to one host, None for no limit
+REQUEST_BURST = 4  # requests sent to one host at once before pacing starts
+HOST_REQUESTS_PER_SECOND = {}  # per-host overrides of REQUESTS_PER_SECOND
+MAX_BACK_OFF_WAIT = 60  # wait out 429/503 back-offs of up to n seconds, else skip host
+CONNECT_TIMEOUT = 10  # seconds to connect, unless set in a site's connect-timeout
+READ_TIMEOUT = 30  # seconds to wait for each read, unless set in a site's read-timeout
 
 ### Message strings
 ## German
@@ -67,119 +154,398 @@ ERR_NOT_FOUND = "Angebotsseite {} konnte nicht gefunden werden. Status war {}.\n
 ERR_SUCCESS_NO_MATCHES = (
     "success-str bei {} gefunden, aber keine Matches. expose-url-pattern überprüfen."
 )
+ERR_PAGE_CONNECTION = (
+    "Die Seite {} ( {} ) scheint nicht zu funktionieren. Weitere Angebote fehlen."
+)
 ERR_EXPOSE_CONNECTION = (
     "Die Seite {} scheint nicht zu funktionieren. Konnte keine Details ermitteln."
 )
 ERR_EXPOSE_NOT_FOUND = ERR_NOT_FOUND
+ERR_TIMEOUT = (
+    "Die Seite {} ( {} ) antwortet nicht rechtzeitig. Konnte keine Angebote prüfen."
+)
+ERR_DEADLINE = (
+    "Die Seite {} konnte nicht innerhalb der maximalen Laufzeit geprüft werden."
+)
+ERR_NOT_CHECKED = "Die Seite {} wurde nicht geprüft, da alle Worker beendet wurden."
+ERR_RATE_LIMITED = (
+    "{} hat um {:.0f} Sekunden Pause gebeten. Bis dahin werden keine Anfragen gesendet."
+)
 
 LOG_CRAWLING = "crawling {}"
 LOG_NO_FLATS = "  no flats found at {}"
+LOG_UNCHANGED = "  {} unchanged since last check"
+LOG_FILTERED = "  {} doesn't match the criteria"
+LOG_CACHE_STATS = "validator cache: {} hits, {} misses"
+LOG_DETAILS_CACHE_STATS = "details cache: {} hits, {} misses"
+LOG_DAEMON_STARTED = ":: daemon started, checking {} sites ::"
+LOG_NEXT_CHECK = "  next check of {} in {:.0f}s"
 LOG_NEW_RESULTS = ":: new results found ::"
-LOG_EMAIL_SENT = ":: email sent ::"
+LOG_PROFILE_RESULTS = ":: new results found for {} ::"
+LOG_FETCH_PLAN = ":: {} profiles, {} sites, {} listing urls ::"
+LOG_SHARED_STATS = "shared fetches: {} requests saved"
+LOG_SHARDS = ":: {} sites in {} shards, {} local workers ::"
+LOG_WORKER_STARTED = ":: worker {} started ::"
+LOG_WORKER_TASK = "  {} took a shard of {} sites"
+LOG_WORKER_UNKNOWN_SITE = "WARNING: {} doesn't know site {} of profile {}"
+LOG_WORKERS_REQUEUED = "WARNING: {} shards taken too long ago, handed out again"
+LOG_WORKERS_EXITED = "ERROR: all local workers exited, {} shards left unchecked"
+LOG_EMAIL_QUEUED = ":: email queued ::"
+LOG_EMAIL_SENT = ":: email sent: {} ::"
+LOG_EMAIL_FAILED = "WARNING: email not sent - {}"
 LOG_NO_NEW_RESULTS = ":: no new results ::"
+LOG_REPLAY = ":: replaying snapshot {} ::"
+LOG_KNOWN_IMPORTED = "imported {} known offers from {}"
+LOG_KNOWN_EXPIRED = "forgot {} offers that disappeared long ago"
+LOG_BREAKER_SKIPPED = "  skipping {}, it keeps failing, next try in {:.0f} minutes"
+LOG_BREAKER_OPENED = 'WARNING: "{}" keeps failing, skipping it for {:.0f} minutes'
+STATS_HEADER = "{: <50} {: >8} {: >12} {: >12}".format(
+    "site", "offers", "median h", "shortest h"
+)
+STATS_ROW = "{: <50} {: >8} {: >12.1f} {: >12.1f}"
 LOG_WARN = 'WARNING: "{}" - {} ({} Neuversuche verbleiben)'
 LOG_ERR = 'ERROR: "{}" - {}'
 
 VERBOSITY = 0
 QUIET = False
 
+print_lock = threading.Lock()
+known_stores = {}
+known_store_lock = threading.Lock()
+validator_cache = None
+validator_cache_lock = threading.Lock()
+details_cache = None
+details_cache_lock = threading.Lock()
+change_history = None
+change_history_lock = threading.Lock()
+circuit_breaker = None
+circuit_breaker_lock = threading.Lock()
+http_client = None
+http_client_lock = threading.Lock()
+snapshot_archive = None
+snapshot_archive_lock = threading.Lock()
+replaying = False
+notifier = None
+notifier_lock = threading.Lock()
+profiler = profiling.NULL
+default_profile = None
+default_profile_lock = threading.Lock()
+loaded_profiles = None
+profiles_lock = threading.Lock()
+
 
 class Site:
     """
     A website to be searched for new flats. Takes a *config* dict, which should include
-    most of the fields specified in `sites.py`.
+    most of the fields specified in `sites.py`, optionally its precompiled
+    :py:class:`extract.ExtractionPlan`, and the :py:class:`profiles.Profile` it is
+    searched for (by default the one from `config.py`), whose criteria and known
+    offers are used.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, plan=None, profile=None):
         self.config = defaultdict(lambda: None, config)
+        self.plan = plan or extract.ExtractionPlan(config)
+        self.profile = profile or get_default_profile()
+        self.criteria = self.profile.criteria if FILTER_OFFERS else None
         self.offers = set()
         self.error = None
+        self.error_kind = None
+        self.attempts = 0
+        self.probe = False  # whether this check probes a site that kept failing
+        self.changed = False
+        self.seen_keys = set()
+        self.complete = False
+        self.pages_failed = False
         self.name = self.config["name"]
         self.url = self.config["url"]
         self.none_str = self.config["none-str"]
         self.success_str = self.config["success-str"]
         self.expose_url_pattern = self.config["expose-url-pattern"]
-        self.expose_details = self.config["expose-details"]
+        self.expose_details = self.plan.details
+        self.list_end_str = self.config["list-end-str"]
+        self.stream = self.config.get("stream", STREAM_LISTINGS)
+        self.page_url = self.config["page-url"]
+        self.max_pages = self.config.get("max-pages", MAX_PAGES)
+        self.newest_first = self.config.get("newest-first", False)
+        self.timeout = (
+            self.config.get("connect-timeout", CONNECT_TIMEOUT),
+            self.config.get("read-timeout", READ_TIMEOUT),
+        )
+        self.deadline = None  # set by crawl(), as a time.monotonic() value
+        self.client = None  # set by crawl(), see get_http_client()
+        self.cache_key = self.url
+        if self.profile.name is not None:
+            self.cache_key = f"{self.profile.name}:{self.url}"
 
-    def check(self, retries=2, backoff=1, include_known=False):
+    def check(self, include_known=False):
         """
-        Check whether there are any flat exposes on a given site. Returns a tuple
-        consisting of a list of offers and error.
-
-        Check retries a certain amount of times (total connection attempts are thus
-        retries+1) with slightly exponential backoff wait time between tries.
+        Check whether there are any flat exposes on a given site, adding them to
+        `offers`. Errors are kept in `error`, and their kind (see retry.py) in
+        `error_kind`, for :py:meth:`retry_delay`.
         """
-        base_url_parts = urlsplit(self.url)[:2]
-
         v(LOG_CRAWLING.format(self.name))
+        self.attempts += 1
         self.error = None
+        self.error_kind = None
+        self.seen_keys = set()
+        self.complete = True
+        self.pages_failed = False
+        validators = get_validator_cache()
         try:
-            result = requests.get(self.url, headers=HEADERS)
+            with profiler.phase("request"):
+                result = self.client.get(
+                    self.url,
+                    headers=(
+                        {}
+                        if include_known
+                        else validators.request_headers(self.cache_key)
+                    ),
+                    stream=self.stream,
+                    timeout=self.timeout,
+                    deadline=self.deadline,
+                )
+            text, content = self.read(result)
+            record_snapshot(self.url, result, text)
+            if not include_known and validators.unchanged(
+                self.cache_key, result, content
+            ):
+                v(LOG_UNCHANGED.format(self.name))
+                get_known_store(self.profile).touch(self.name)
+                return
             if not result.ok:
                 self.error = ERR_NOT_FOUND.format(
                     self.name, format_code(result.status_code), self.url
                 )
+                self.error_kind = retry.classify_status(result.status_code)
 
             elif self.success_str is None:
                 if self.check_and_update_known(
-                    self.url, result.text, include_known=include_known
+                    self.url, text, include_known=include_known
                 ):
-                    self.offers.add(Offer(self.url, self.expose_details))
-            elif self.success_str in result.text:
-                debug_dump_site_html(self.name, result.text)
-                if self.expose_url_pattern is not None:
-                    matches = re.findall(self.expose_url_pattern, result.text)
-                else:
+                    self.offers.add(
+                        Offer(self.url, self.expose_details, timeout=self.timeout)
+                    )
+            elif self.success_str in text:
+                if self.expose_url_pattern is None:
                     self.offers.add(Offer(EMAIL_SITE_NO_LIST_TEXT.format(self.url)))
                     return
-                for match in matches:
-                    match_url = match if isinstance(match, str) else match.group(1)
-                    if not urlparse(match_url).scheme:
-                        match_url = urlunparse(base_url_parts + (match_url, "", "", ""))
-                    if self.check_and_update_known(
-                        match_url, include_known=include_known
-                    ):
-                        self.offers.add(Offer(match_url, self.expose_details))
+                matches, new = self.add_offers(text, include_known)
                 if not matches:
                     self.error = ERR_SUCCESS_NO_MATCHES.format(self.name)
-            elif self.none_str and (self.none_str in result.text):
+                    self.error_kind = "content"
+                elif new or not self.newest_first:
+                    self.check_pages(text, include_known)
+                else:
+                    self.complete = self.plan.next_page is None and not self.page_url
+            elif self.none_str and (self.none_str in text):
                 v(LOG_NO_FLATS.format(self.name))
             else:
                 self.error = ERR_CONNECTION.format(
                     self.name, truncate(self.url, URL_PRINT_LENGTH)
                 )
-        except requests.exceptions.ConnectionError:
+                self.error_kind = "content"
+        except fetch.RateLimited as error:
+            self.error = ERR_RATE_LIMITED.format(self.name, error.seconds)
+            self.error_kind = retry.classify(error)
+        except fetch.DeadlineExceeded as error:
+            self.error = ERR_DEADLINE.format(self.name)
+            self.error_kind = retry.classify(error)
+        except requests.exceptions.Timeout as error:
+            self.error = ERR_TIMEOUT.format(
+                self.name, truncate(self.url, URL_PRINT_LENGTH)
+            )
+            self.error_kind = retry.classify(error)
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+        ) as error:
             self.error = ERR_CONNECTION.format(
                 self.name, truncate(self.url, URL_PRINT_LENGTH)
             )
-        if self.error:
-            if retries > 0:
-                err(LOG_WARN.format(self.name, self.error, retries))
-                time.sleep(backoff)
-                return self.check(retries - 1, (backoff + 2) * 1.5)
+            self.error_kind = retry.classify(error)
+        if not self.error:
+            if not self.pages_failed:  # else they'd be skipped as unchanged next time
+                validators.update(self.cache_key, result, content)
+            if self.complete:
+                get_known_store(self.profile).listing(self.name, self.seen_keys)
+
+    def retry_delay(self, policy):
+        """
+        Return the seconds to wait before checking the site again after an error, as
+        the :py:class:`retry.RetryPolicy` *policy* says, or None if it isn't retried,
+        and log the error. Probes aren't retried, nor checks that would have to wait
+        beyond the deadline.
+        """
+        if self.error is None:
+            return None
+        delay = None if self.probe else policy.delay(self.error_kind, self.attempts)
+        if delay is not None and self.deadline is not None:
+            if time.monotonic() + delay >= self.deadline:
+                delay = None
+        if delay is None:
+            err(LOG_ERR.format(self.name, self.error))
+        else:
+            retries_left = policy.retries - self.attempts + 1
+            err(LOG_WARN.format(self.name, self.error, retries_left))
+        return delay
+
+    def read(self, result):
+        """
+        Return the text of a listing page *result*, and its raw content if it was read
+        completely (else None). When streaming, reading stops as soon as `success-str`
+        or `none-str` is found, whichever comes first. After `success-str`, reading
+        continues only up to `list-end-str`, if given, for the exposé links. Sites
+        without `success-str` are read up to the end of their fingerprint region.
+        """
+        with profiler.phase("download") as record:
+            if not self.stream or not result.ok or result.status_code == 304:
+                try:
+                    record.bytes = len(result.content)
+                finally:
+                    result.close()
+                return result.text, result.content
+            scanner = fetch.StreamScanner(result, deadline=self.deadline)
+            try:
+                self.read_stream(scanner)
+            finally:
+                scanner.close()
+                record.bytes = scanner.size
+            return scanner.text, scanner.content
+
+    def read_stream(self, scanner):
+        """Read from *scanner* as far as needed, see :py:meth:`read`."""
+        if self.success_str is None:
+            start, end = self.plan.fingerprint_start, self.plan.fingerprint_end
+            found = scanner.read_until(start)
+            if found or not start:
+                region = scanner.text.find(start) + len(start) if start else 0
+                scanner.read_until(end, start=region)
+        elif (
+            scanner.read_until(self.success_str, self.none_str) == self.success_str
+            and self.expose_url_pattern is not None
+        ):
+            scanner.read_until(self.list_end_str)
+
+    def add_offers(self, text, include_known=False):
+        """
+        Add an offer for each new exposé link on the listing page *text*. Offers whose
+        `listing-details` don't match the criteria are skipped, without marking them as
+        known. Returns the list of all links, and the number of offers added.
+        """
+        base_url_parts = urlsplit(self.url)[:2]
+        with profiler.phase("expose-urls"):
+            matches = self.plan.find_listing_entries(text)
+        new = 0
+        for match_url, listing_details in matches:
+            if not urlparse(match_url).scheme:
+                match_url = urlunparse(base_url_parts + (match_url, "", "", ""))
+            offer = Offer(match_url, self.expose_details, listing_details, self.timeout)
+            if not offer.matches(self.criteria):
+                vv(LOG_FILTERED.format(match_url))
+                continue
+            if self.check_and_update_known(match_url, include_known=include_known):
+                self.offers.add(offer)
+                new += 1
+        return matches, new
+
+    def check_pages(self, text, include_known=False):
+        """
+        Check the listing pages following the first one, whose *text* is given, up to
+        `max-pages`. Pages are found through `next-page-pattern`, or numbered with
+        `page-url`. If the number of pages is known from `page-count-pattern`, numbered
+        pages are retrieved concurrently. Otherwise they are retrieved one after
+        another, until a page without exposé links. Sites with `newest-first` stop at
+        the first page without new offers. Unless all pages were checked, `complete` is
+        set to False, and if pages couldn't be retrieved, `pages_failed` is set.
+        """
+        if self.plan.next_page is None and self.page_url is None:
+            return
+        last_page = self.max_pages
+        page_count = self.plan.find_page_count(text)
+        if page_count is not None:
+            last_page = min(page_count, last_page)
+        more_pages = page_count is None or page_count > self.max_pages
+        if page_count is not None and self.page_url and not self.newest_first:
+            urls = [self.page_url.format(page=page) for page in range(2, last_page + 1)]
+            with futures.ThreadPoolExecutor(MAX_CONCURRENT_PAGES) as executor:
+                texts = list(executor.map(self.fetch_page, urls))
+            for text in texts:
+                if text is None:
+                    self.complete = False
+                    self.pages_failed = True
+                elif self.success_str in text:
+                    self.add_offers(text, include_known)
+            self.complete = self.complete and not more_pages
+            return
+        url = self.url
+        for page in range(2, last_page + 1):
+            if self.plan.next_page is not None:
+                next_url = self.plan.find_next_page(text)
+                if next_url is None:
+                    return
+                url = urljoin(url, next_url)
             else:
-                err(LOG_ERR.format(self.name, self.error))
+                url = self.page_url.format(page=page)
+            text = self.fetch_page(url)
+            if text is None:
+                self.complete = False
+                self.pages_failed = True
+                return
+            if self.success_str not in text:
+                return
+            matches, new = self.add_offers(text, include_known)
+            if not matches:
+                return
+            if self.newest_first and not new:
+                self.complete = False
+                return
+        self.complete = not more_pages
+
+    def fetch_page(self, url):
+        """
+        Return the text of the listing page *url*, or None if it can't be retrieved.
+        Errors are only logged, so that offers on the other pages are still reported.
+        """
+        with profiler.site(self.name):
+            try:
+                with profiler.phase("page-request"):
+                    result = self.client.get(
+                        url, timeout=self.timeout, deadline=self.deadline
+                    )
+                with profiler.phase("page-download") as record:
+                    record.bytes = len(result.content)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout,
+            ):
+                error = ERR_PAGE_CONNECTION.format(
+                    self.name, truncate(url, URL_PRINT_LENGTH)
+                )
+                err(LOG_ERR.format(self.name, error))
+                return None
+            record_snapshot(url, result, result.text)
+            if not result.ok:
+                error = ERR_NOT_FOUND.format(
+                    self.name, format_code(result.status_code), url
+                )
+                err(LOG_ERR.format(self.name, error))
+                return None
+            return result.text
 
     def check_and_update_known(self, url, text=None, include_known=False):
         """Keep track of individual flat urls that we've already seen."""
         if text is not None:
-            url += (
-                "|"
-                + sha1(
-                    BeautifulSoup(text, "html.parser").get_text().encode()
-                ).hexdigest()
-            )
-        try:
-            known_file_path = Path(KNOWN_FILE)
-            known_file_path.touch()
-            with known_file_path.open("r+") as known_file:
-                if any(True for known in known_file if url in known):
-                    return include_known
-                else:
-                    print(url, file=known_file)
-                    return True
-        except FileNotFoundError:
-            pass
+            with profiler.phase("fingerprint"):
+                url += "|" + self.plan.fingerprint(text)
+        with profiler.phase("known"):
+            new = get_known_store(self.profile).check_and_add(url, self.name)
+        self.seen_keys.add(url)
+        if new:
+            self.changed = True
+            return True
+        return include_known
 
     def __str__(self):
         if self.error:
@@ -201,16 +567,35 @@ class Site:
 
 class Offer:
     """
-    A single offer exposé. Takes a *url*, and if given a *details* dict, will retrieve
-    those details from the *url*, if present.
+    A single offer exposé. Takes a *url*, and if given a *details* dict, those details
+    can be retrieved from the *url* later on, see :py:func:`fetch_details`. Details
+    already known from the listing page can be given as *listing_details*. The typed
+    values of both are kept in `record`, see :py:class:`filters.OfferRecord`. The
+    exposé is retrieved with the (connect, read) *timeout* of its site.
     """
 
-    def __init__(self, url, details=None):
+    __slots__ = ("url", "details", "record")
+
+    def __init__(self, url, details=None, listing_details=None, timeout=None):
         self.url = url
-        self.details = OfferDetails(url, details) if details else None
+        self.details = OfferDetails(url, details, timeout) if details else None
+        self.record = filters.OfferRecord(url)
+        if listing_details:
+            self.record.update(listing_details)
+
+    def matches(self, criteria):
+        """
+        Return whether the offer matches the :py:class:`filters.Criteria` *criteria*,
+        as far as its details are known. Always True if *criteria* is None.
+        """
+        if criteria is None:
+            return True
+        if self.details and self.details.fetched:
+            self.record.update(self.details.details)
+        return criteria.matches(self.record)
 
     def __str__(self):
-        if self.details:
+        if self.details and self.details.fetched:
             return (
                 f"  ✔ {self.details.title}\n"
                 + f"    {self.url}\n"
@@ -223,38 +608,102 @@ class Offer:
 class OfferDetails:
     """
     A list of extra details about an offer exposé. Takes a *url*, and a *config* dict,
-    much like :py:class:`Site` does, containing keys with regex strings. The *url* is
-    retrieved and any details for which the regex patterns match will be collected into
-    `self.details`.
+    much like :py:class:`Site` does, containing keys with regex strings (or its compiled
+    :py:class:`extract.DetailsPlan`). On `fetch()`
+    the *url* is retrieved and any details for which the regex patterns match will be
+    collected into `self.details`. Until then, `self.details` is empty. Details of
+    exposés that were retrieved before are taken from the details cache instead, see
+    :py:func:`get_details_cache`. Only pages with details (including the title, if
+    configured) are cached. The exposé is retrieved with the (connect, read)
+    *timeout*, by default CONNECT_TIMEOUT and READ_TIMEOUT.
     """
 
-    def __init__(self, url, config):
+    def __init__(self, url, config, timeout=None):
+        if not isinstance(config, extract.DetailsPlan):
+            config = extract.DetailsPlan(config)
         self.config = config
         self.url = url
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
         self.details = defaultdict(lambda: None, {})
         self.title = None
+        self.error = None
+        self.fetched = False
 
+    def fetch(self, deadline=None, fetches=None):
+        """
+        Retrieve the exposé and extract the details, unless the `time.monotonic()` value
+        *deadline* passes first. Only fetches once. Of the offers fetched with the same
+        *fetches* dict (e.g. those of several profiles within a crawl), only the first
+        retrieves an exposé, the others take its details and error.
+        """
+        if self.fetched:
+            return
+        self.fetched = True
+        if fetches is None:
+            self.retrieve(deadline)
+            return
+        first = futures.Future()
+        fetched = fetches.setdefault((self.url, self.config.key), first)
+        if fetched is not first:
+            other = fetched.result()
+            self.update(other.details)
+            self.title = other.title
+            self.error = other.error
+            return
         try:
-            result = requests.get(self.url, headers=HEADERS)
+            self.retrieve(deadline)
+        except BaseException as error:
+            first.set_exception(error)
+            raise
+        first.set_result(self)
+
+    def retrieve(self, deadline=None):
+        """Retrieve the exposé (or its cached details), see :py:meth:`fetch`."""
+        details_cache = get_details_cache()
+        with profiler.phase("details-cache"):
+            details = details_cache.get(self.url, self.config.key)
+        if details is not None:
+            self.update(details)
+            return
+        try:
+            with profiler.phase("expose-request"):
+                result = get_http_client().get(
+                    self.url, timeout=self.timeout, deadline=deadline
+                )
+            with profiler.phase("expose-download") as record:
+                record.bytes = len(result.content)
+            record_snapshot(self.url, result, result.text)
             if not result.ok:
                 self.error = ERR_EXPOSE_NOT_FOUND.format(
                     "", format_code(result.status_code), self.url
                 )
             else:
-                for key, detail_pattern in self.config.items():
-                    match = re.search(detail_pattern, result.text)
-                    if match:
-                        match_str = (
-                            match
-                            if isinstance(match, str)
-                            else " ".join(match.groups(""))
-                        )
-                        if key == "title":
-                            self.title = match_str.strip()
-                        else:
-                            self.details[key] = match_str.strip()
-        except requests.exceptions.ConnectionError:
-            self.error = ERR_CONNECTION.format(truncate(self.url, URL_PRINT_LENGTH))
+                with profiler.phase("expose-details"):
+                    details = self.config.extract(result.text)
+                self.update(details)
+                if details and (
+                    "title" in details or "title" not in self.config.patterns
+                ):
+                    # not e.g. an error page, or an offer that is gone
+                    details_cache.put(self.url, self.config.key, details)
+        except fetch.RateLimited as error:
+            self.error = ERR_RATE_LIMITED.format(
+                truncate(self.url, URL_PRINT_LENGTH), error.seconds
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.error = ERR_EXPOSE_CONNECTION.format(
+                truncate(self.url, URL_PRINT_LENGTH)
+            )
+        if self.error:
+            err(LOG_ERR.format(self.url, self.error))
+
+    def update(self, details):
+        """Take the title and details from the extracted *details* dict."""
+        for key, match_str in details.items():
+            if key == "title":
+                self.title = match_str
+            else:
+                self.details[key] = match_str
 
     def __str__(self):
         return "\n".join(
@@ -263,26 +712,666 @@ class OfferDetails:
 
 
 def main(options):
-    """Check all pages, send emails if any offers or errors."""
-    results = []
-
-    for site_config in site_configs:
-        site = Site(site_config)
-        site.check(include_known=options.include_known)
-        if any(site.offers) or site.error is not None:
-            results.append(site)
-    if results:
-        v(LOG_NEW_RESULTS)
-        mail_subject, mail_text = format_mail(results)
+    """
+    Check all pages, send emails if any offers or errors. With `options.replay`, pages
+    are read from that snapshot instead, and the email is only printed.
+    """
+    if options.replay:
+        start_replay(options.replay)
+        options.no_email = True
+    if not options.no_email:
+        get_notifier()  # sends any emails left over from previous runs meanwhile
+    sites = [Site(config, plan, profile) for profile, config, plan in site_targets()]
+    if options.workers and not options.replay:
+        exit_code = report(coordinate(sites, options), options)
+    else:
+        exit_code = report(crawl(sites, options), options)
+    if notifier is not None:
+        notifier.close()
+    if options.profile:
+        err(profiler.table())
+    if options.profile_trace:
+        with open(options.profile_trace, "w") as trace_file:
+            print(profiler.chrome_trace(), file=trace_file)
+    return exit_code
+
+
+def daemon(options):
+    """
+    Keep checking all pages, each on its own interval (see :py:func:`site_interval`),
+    randomly shifted by up to DAEMON_JITTER. Sites due at the same time are checked
+    together, while other sites keep being checked. New offers of all sites are
+    reported in at most one email per MAIL_WINDOW seconds and profile. HTTP connections,
+    compiled site patterns, the known stores and the SMTP connection are kept open
+    between checks. Sites with the same url are checked together for all profiles, on
+    the shortest of their intervals.
+    """
+    tasks = scheduler.Scheduler(jitter=DAEMON_JITTER)
+    coalescers = mail_coalescers(options)
+    if not options.no_email:
+        get_notifier()
+    groups = profiles.fetch_plan(site_targets())
+
+    def check_due(due):
+        sites = {
+            index: [
+                Site(config, plan, profile) for profile, config, plan in groups[index]
+            ]
+            for index in due
+        }
+        try:
+            report(
+                crawl([site for index in due for site in sites[index]], options),
+                options,
+                coalescers,
+            )
+        except Exception as error:
+            err(LOG_ERR.format("daemon", repr(error)))
+        finally:
+            for index in due:
+                interval = min(site_interval(site) for site in sites[index])
+                vv(LOG_NEXT_CHECK.format(sites[index][0].name, interval))
+                tasks.schedule(index, interval)
+
+    for index in range(len(groups)):
+        tasks.schedule(index, 0)
+    v(LOG_DAEMON_STARTED.format(len(groups)))
+    with futures.ThreadPoolExecutor(max_workers=max(1, options.jobs)) as executor:
+        while True:
+            executor.submit(check_due, tasks.wait())
+
+
+def offer_stats():
+    """
+    Return a table of how long the offers of each site stayed online, from first seen
+    to disappeared, to help tune the check intervals.
+    """
+    rows = [STATS_HEADER]
+    for profile in get_profiles():
+        prefix = "" if profile.name is None else f"{profile.name}: "
+        for site, lifetimes in sorted(get_known_store(profile).lifetimes().items()):
+            rows.append(
+                STATS_ROW.format(
+                    (prefix + site)[:50],
+                    len(lifetimes),
+                    statistics.median(lifetimes) / hours,
+                    min(lifetimes) / hours,
+                )
+            )
+    return "\n".join(rows)
+
+
+def site_interval(site):
+    """
+    Return the number of seconds until *site* should be checked again: the site's
+    `interval`, or CHECK_INTERVAL. With ADAPTIVE_INTERVALS, adapt it to how often the
+    site's offers changed recently, within the site's `interval-min` and `interval-max`
+    (or MIN_INTERVAL and MAX_INTERVAL).
+    """
+    interval = site.config["interval"] or CHECK_INTERVAL
+    if not ADAPTIVE_INTERVALS:
+        return interval
+    return scheduler.adaptive_interval(
+        get_change_history().recent(site.name),
+        time.time(),
+        default=interval,
+        min_interval=site.config["interval-min"] or MIN_INTERVAL,
+        max_interval=site.config["interval-max"] or MAX_INTERVAL,
+        boost=CHANGE_BOOST,
+    )
+
+
+def crawl(sites, options):
+    """
+    Check the given *sites*, and yield those with offers or errors as soon as they are
+    done, including the details of their offers. Up to `options.jobs` sites are checked
+    concurrently. Offer details are fetched in a second stage as soon as a site's offers
+    are known. The known store etc. are updated once all sites are done.
+
+    Sites with errors are checked again after a delay, as far as RETRIES and
+    RETRY_ERRORS allow, while other sites are checked in the meantime. Sites that
+    failed to respond in BREAKER_FAILURES runs in a row are skipped for a while, see
+    :py:func:`get_circuit_breaker`.
+
+    Requests still outstanding `options.deadline` seconds after the start are
+    cancelled, and sites that weren't checked by then are yielded with an error.
+    Listing pages and exposés requested by sites of several profiles are only retrieved
+    once in the crawl, see :py:class:`fetch.SharedClient`.
+    """
+    deadline = None
+    if options.deadline:
+        deadline = time.monotonic() + options.deadline
+    client = get_http_client()
+    if len({site.profile for site in sites}) > 1:
+        client = fetch.SharedClient(client)
+    for site in sites:
+        site.deadline = deadline
+        site.client = client
+    policy = retry.RetryPolicy(RETRIES, RETRY_ERRORS, RETRY_BACKOFF)
+    breaker = get_circuit_breaker()
+    checked = []
+    for site in sites:
+        state = breaker.state(site.url)
+        if state == retry.OPEN:
+            minutes_left = (breaker.until(site.url) - time.time()) / minutes
+            v(LOG_BREAKER_SKIPPED.format(site.name, minutes_left))
+            continue
+        site.probe = state == retry.HALF_OPEN
+        checked.append(site)
+
+    def check(site):
+        with profiler.site(site.name):
+            site.check(include_known=options.include_known)
+        return site
+
+    def finish(site):
+        """Drop offers that don't match after all, return whether to report *site*."""
+        site.offers = {offer for offer in site.offers if offer.matches(site.criteria)}
+        return any(site.offers) or site.error is not None
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, options.jobs)) as executor:
+        with futures.ThreadPoolExecutor(
+            max_workers=max(1, options.jobs)
+        ) as details_executor:
+            checks = {executor.submit(check, site): site for site in checked}
+            detail_sites = {}
+            exposes = {}  # exposé fetches of this crawl, shared by all profiles
+            details_left = defaultdict(int)
+            retries = []  # heap of (time.monotonic() when due, id, site)
+            pending = set(checks)
+            while pending or retries:
+                done, pending = futures.wait(
+                    pending,
+                    timeout=(
+                        max(0, retries[0][0] - time.monotonic()) if retries else None
+                    ),
+                    return_when=futures.FIRST_COMPLETED,
+                )
+                while retries and retries[0][0] <= time.monotonic():
+                    site = heapq.heappop(retries)[2]
+                    future = executor.submit(check, site)
+                    checks[future] = site
+                    pending.add(future)
+                for future in done:
+                    future.result()
+                    if future in checks:
+                        site = checks.pop(future)
+                        delay = site.retry_delay(policy)
+                        if delay is not None:
+                            heapq.heappush(
+                                retries, (time.monotonic() + delay, id(site), site)
+                            )
+                            continue
+                        if not any(site.offers) and site.error is None:
+                            continue
+                        fetches = fetch_details(
+                            site.offers,
+                            details_executor,
+                            site.name,
+                            deadline,
+                            exposes,
+                        )
+                        if not fetches and finish(site):
+                            yield site
+                        for details_future in fetches:
+                            detail_sites[details_future] = site
+                            details_left[site] += 1
+                        pending.update(fetches)
+                    else:
+                        site = detail_sites.pop(future)
+                        details_left[site] -= 1
+                        if not details_left[site] and finish(site):
+                            yield site
+    with profiler.phase("known-flush"):
+        expired = 0
+        for profile in {site.profile for site in sites}:
+            get_known_store(profile).flush()
+            expired += get_known_store(profile).expire(KNOWN_RETENTION)
+    if expired:
+        vv(LOG_KNOWN_EXPIRED.format(expired))
+    if SNAPSHOTS_KEEP and not replaying:
+        get_snapshot_archive().save()
+    history = get_change_history()
+    for name in {site.name for site in sites if site.changed}:
+        history.record(name)
+    outcomes = {}
+    for site in checked:
+        if outcomes.get(site.url) not in retry.FAILURE_KINDS:
+            outcomes[site.url] = site.error_kind
+    for url, kind in outcomes.items():
+        cooldown = breaker.record(url, kind)
+        if cooldown is not None:
+            err(LOG_BREAKER_OPENED.format(url, cooldown / minutes))
+    validators = get_validator_cache()
+    v(LOG_CACHE_STATS.format(validators.hits, validators.misses))
+    details_cache = get_details_cache()
+    details_cache.expire()
+    v(LOG_DETAILS_CACHE_STATS.format(details_cache.hits, details_cache.misses))
+    if isinstance(client, fetch.SharedClient):
+        v(LOG_SHARED_STATS.format(client.hits))
+
+
+def coordinate(sites, options):
+    """
+    Like :py:func:`crawl`, but split the *sites* into `options.workers` shards by host,
+    and have them checked by as many worker processes, through the work queue at
+    `options.queue`. Workers on other machines sharing the queue may take shards as
+    well. Sites with offers or errors are yielded as the workers report them. Once all
+    local workers exited, shards still taken by other workers are waited for, until
+    they are handed out again after WORKER_TASK_TIMEOUT, or `options.deadline` passed.
+    The sites of the shards left then are yielded with an error.
+    """
+    deadline = None
+    if options.deadline:
+        deadline = time.monotonic() + options.deadline
+    shards = defaultdict(list)
+    for site in sites:
+        shards[workers.shard(site.url, options.workers)].append(site)
+    queue = workers.WorkQueue(options.queue)
+    run = queue.submit_run(
+        [
+            {
+                "include_known": options.include_known,
+                "sites": [[site.profile.name, site.url] for site in shard_sites],
+            }
+            for shard_sites in shards.values()
+        ]
+    )
+    sites_by_key = {(site.profile.name, site.url): site for site in sites}
+    v(LOG_SHARDS.format(len(sites), len(shards), min(options.workers, len(shards))))
+    processes = [
+        subprocess.Popen(worker_command(options))
+        for _ in range(min(options.workers, len(shards)))
+    ]
+    last_result = 0
+    reported = set()
+    unfinished = list(shards)
+    unchecked = []
+    try:
+        while True:
+            unfinished = queue.unfinished(run)
+            if unfinished and all(process.poll() is not None for process in processes):
+                untaken = queue.untaken(run)
+                if len(untaken) == len(unfinished):
+                    unchecked = untaken
+                elif deadline is not None and time.monotonic() >= deadline:
+                    unchecked = unfinished
+                if unchecked:
+                    err(LOG_WORKERS_EXITED.format(len(unchecked)))
+                    unfinished = []
+            for result_id, result in queue.results(run, last_result):
+                last_result = result_id
+                key = (result["profile"], result["url"])
+                if key not in reported:
+                    reported.add(key)
+                    yield restore_site(sites_by_key[key], result)
+            if not unfinished:
+                break
+            requeued = queue.requeue_stale(run, WORKER_TASK_TIMEOUT)
+            if requeued:
+                err(LOG_WORKERS_REQUEUED.format(requeued))
+            time.sleep(WORKER_POLL)
+        for payload in unchecked:
+            for key in map(tuple, payload["sites"]):
+                if key not in reported:
+                    site = sites_by_key[key]
+                    site.error = ERR_NOT_CHECKED.format(site.name)
+                    yield site
+    finally:
+        for process in processes:
+            if unfinished:
+                process.terminate()
+            process.wait()
+        queue.clear(run)
+        queue.close()
+
+
+def work(options):
+    """
+    Take shards of sites from the work queue at `options.queue` and check them, posting
+    each site with offers or errors to the queue as soon as it is done, see
+    :py:func:`coordinate`. Waits for further shards, or with `options.exit_when_idle`,
+    returns once there are none. The known stores, caches etc. are shared with the
+    coordinator and other workers on the same machine.
+    """
+    queue = workers.WorkQueue(options.queue)
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    targets = {
+        (profile.name, config["url"]): (profile, config, plan)
+        for profile, config, plan in site_targets()
+    }
+    v(LOG_WORKER_STARTED.format(name))
+    while True:
+        task = queue.take(name)
+        if task is None:
+            if options.exit_when_idle:
+                return 0
+            time.sleep(WORKER_POLL)
+            continue
+        vv(LOG_WORKER_TASK.format(name, len(task.payload["sites"])))
+        sites = []
+        for profile_name, url in task.payload["sites"]:
+            if (profile_name, url) not in targets:
+                err(LOG_WORKER_UNKNOWN_SITE.format(name, url, profile_name))
+                continue
+            profile, config, plan = targets[(profile_name, url)]
+            sites.append(Site(config, plan, profile))
+        task_options = copy.copy(options)
+        task_options.include_known = task.payload["include_known"]
+        try:
+            for site in crawl(sites, task_options):
+                queue.post(task.id, site_result(site))
+        except Exception as error:
+            err(LOG_ERR.format(name, repr(error)))
+        finally:
+            queue.finish(task.id)
+
+
+def worker_command(options):
+    """Return the command line of a local worker process for :py:func:`coordinate`."""
+    return [
+        sys.executable,
+        os.path.realpath(__file__),
+        "worker",
+        "--queue",
+        options.queue,
+        "--exit-when-idle",
+        "--jobs",
+        str(options.jobs),
+        "--deadline",
+        str(options.deadline or 0),
+        *(["--verbose"] * VERBOSITY),
+        *(["--quiet"] if QUIET else []),
+    ]
+
+
+def site_result(site):
+    """Return the error and offers of *site* as a dict, to pass between processes."""
+    return {
+        "profile": site.profile.name,
+        "url": site.url,
+        "error": site.error,
+        "offers": [
+            {
+                "url": offer.url,
+                "details": (
+                    {**offer.details.details, "title": offer.details.title}
+                    if offer.details and offer.details.fetched
+                    else None
+                ),
+            }
+            for offer in site.offers
+        ],
+    }
+
+
+def restore_site(site, result):
+    """Take the error and offers from the `site_result()` *result* into *site*."""
+    site.error = result["error"]
+    for stored in result["offers"]:
+        if stored["details"] is None:
+            site.offers.add(Offer(stored["url"]))
+            continue
+        offer = Offer(stored["url"], site.expose_details)
+        offer.details.fetched = True
+        offer.details.update(stored["details"])
+        site.offers.add(offer)
+    return site
+
+
+def report(results, options, coalescers=None):
+    """
+    Pass the sites in *results* on to an email to their profile's recipients (or with
+    `options.no_email`, stdout) as they come in, at most one per MAIL_WINDOW seconds and
+    profile, see :py:func:`sink`. Uses the given *coalescers* per profile, else new ones
+    which are closed once *results* are exhausted, see :py:func:`mail_coalescers`.
+    Returns the exit code, which is 1 if any site had errors.
+    """
+    own_coalescers = coalescers is None
+    if own_coalescers:
+        coalescers = mail_coalescers(options)
+    found = False
+    errors = False
+    try:
+        for site in results:
+            found = True
+            errors = errors or site.error is not None
+            coalescers[site.profile].add(site)
+    finally:
+        if own_coalescers:
+            for coalescer in coalescers.values():
+                coalescer.close()
+    if not found:
+        v(LOG_NO_NEW_RESULTS)
+    return 1 if errors else 0
+
+
+def mail_coalescers(options):
+    """Return a dict of a new :py:class:`notify.Coalescer` for each profile."""
+    return {
+        profile: notify.Coalescer(MAIL_WINDOW, sink(options, profile))
+        for profile in get_profiles()
+    }
+
+
+def sink(options, profile=None):
+    """
+    Return a function sending an email about a list of sites to the recipients of
+    *profile* (by default the ones in `config.py`), or printing it with
+    `options.no_email`.
+    """
+    profile = profile or get_default_profile()
+
+    def send(sites):
+        if profile.name is None:
+            v(LOG_NEW_RESULTS)
+        else:
+            v(LOG_PROFILE_RESULTS.format(profile.name))
+        mail_subject, mail_text = format_mail(sites)
         if options.no_email:
-            print(f"{mail_subject}\n\n{mail_text}")
+            with print_lock:
+                print(f"{mail_subject}\n\n{mail_text}")
         else:
-            send_mail(mail_subject, mail_text)
-            v(LOG_EMAIL_SENT)
-        vv(results)
+            send_mail(mail_subject, mail_text, profile.recipients)
+            v(LOG_EMAIL_QUEUED)
+        vv(sites)
+
+    return send
+
+
+def fetch_details(offers, executor, site_name=None, deadline=None, fetches=None):
+    """
+    Submit the detail retrieval of all *offers* to *executor*, without waiting for it to
+    finish, and return the list of futures. Profiling phases are attributed to
+    *site_name*. Exposés not retrieved by the `time.monotonic()` value *deadline* are
+    left without details. Exposés are retrieved only once for all offers fetched with
+    the same *fetches* dict, see :py:meth:`OfferDetails.fetch`.
+    """
+
+    def fetch(offer_details):
+        with profiler.site(site_name):
+            offer_details.fetch(deadline, fetches)
+
+    return [executor.submit(fetch, offer.details) for offer in offers if offer.details]
+
+
+def get_known_store(profile=None):
+    """
+    Return the store of known offers of *profile* (by default the one from
+    `config.py`), opening it on first use. An existing legacy KNOWN_FILE is imported
+    into the default store the first time. While replaying, stores are kept in memory.
+    """
+    profile = profile or get_default_profile()
+    with known_store_lock:
+        store = known_stores.get(profile.name)
+        if store is None:
+            store = known.KnownStore(":memory:" if replaying else profile.known_path)
+            known_stores[profile.name] = store
+            if profile.name is None and not replaying:
+                imported = store.import_file(KNOWN_FILE)
+                if imported:
+                    v(LOG_KNOWN_IMPORTED.format(imported, KNOWN_FILE))
+        return store
+
+
+def get_default_profile():
+    """
+    Return the profile of the criteria in `config.py` and the sites in `sites.py`,
+    loading and compiling the sites on first use.
+    """
+    global default_profile
+    with default_profile_lock:
+        if default_profile is None:
+            from sites import sites as site_configs
+
+            default_profile = profiles.Profile(None, config, site_configs, KNOWN_DB)
+        return default_profile
+
+
+def get_profiles():
+    """
+    Return the profiles to crawl for, loading them on first use: one for each config
+    file in PROFILES_PATH, or if there are none, the default profile.
+    """
+    global loaded_profiles
+    with profiles_lock:
+        if loaded_profiles is None:
+            loaded_profiles = profiles.load(PROFILES_PATH, KNOWN_DB) or [
+                get_default_profile()
+            ]
+        return loaded_profiles
+
+
+def site_targets():
+    """
+    Return a (profile, site config, extraction plan) tuple for each site of each
+    profile. With several profiles, logs how many of their sites are shared.
+    """
+    targets = [
+        (profile, config, plan)
+        for profile in get_profiles()
+        for config, plan in zip(profile.site_configs, profile.site_plans)
+    ]
+    if len(get_profiles()) > 1:
+        v(
+            LOG_FETCH_PLAN.format(
+                len(get_profiles()), len(targets), len(profiles.fetch_plan(targets))
+            )
+        )
+    return targets
+
+
+def get_validator_cache():
+    """Return the cache of listing page validators, opening it on first use."""
+    global validator_cache
+    with validator_cache_lock:
+        if validator_cache is None:
+            validator_cache = cache.ValidatorCache(VALIDATOR_CACHE_DB)
+        return validator_cache
+
+
+def get_details_cache():
+    """
+    Return the cache of exposé details, opening it on first use. Details are reused for
+    DETAILS_CACHE_TTL seconds, for at most DETAILS_CACHE_SIZE exposés.
+    """
+    global details_cache
+    with details_cache_lock:
+        if details_cache is None:
+            details_cache = cache.DetailsCache(
+                DETAILS_CACHE_DB, ttl=DETAILS_CACHE_TTL, max_entries=DETAILS_CACHE_SIZE
+            )
+        return details_cache
+
+
+def get_change_history():
+    """Return the history of site changes, opening it on first use."""
+    global change_history
+    with change_history_lock:
+        if change_history is None:
+            change_history = scheduler.ChangeHistory(CHANGE_HISTORY_DB)
+        return change_history
+
+
+def get_circuit_breaker():
+    """
+    Return the circuit breaker of sites that failed to respond in BREAKER_FAILURES runs
+    in a row, opening it on first use. Those are skipped for BREAKER_COOLDOWN seconds,
+    then probed once, and skipped twice as long (up to BREAKER_MAX_COOLDOWN) each time
+    the probe fails, until they respond again.
+    """
+    global circuit_breaker
+    with circuit_breaker_lock:
+        if circuit_breaker is None:
+            circuit_breaker = retry.CircuitBreaker(
+                BREAKER_DB,
+                threshold=BREAKER_FAILURES,
+                cooldown=BREAKER_COOLDOWN,
+                max_cooldown=BREAKER_MAX_COOLDOWN,
+            )
+        return circuit_breaker
+
+
+def get_snapshot_archive():
+    """Return the archive of retrieved pages."""
+    global snapshot_archive
+    with snapshot_archive_lock:
+        if snapshot_archive is None:
+            snapshot_archive = snapshots.Archive(SNAPSHOTS_PATH, keep=SNAPSHOTS_KEEP)
+        return snapshot_archive
+
+
+def record_snapshot(url, result, text):
+    """Record a retrieved page in the snapshot archive, unless replaying."""
+    if not SNAPSHOTS_KEEP or replaying:
+        return
+    if result.status_code == 304:
+        get_snapshot_archive().record_unchanged(url)
     else:
-        v(LOG_NO_NEW_RESULTS)
-    return 0 if all([r.error is None for r in results]) else 1
+        get_snapshot_archive().record(url, result.status_code, text)
+
+
+def start_replay(snapshot):
+    """
+    Serve all pages from *snapshot* instead of the network, and keep known offers,
+    validators, exposé details, change history and circuit breakers in memory only, so
+    replays can be repeated, and exposé details are extracted from the snapshot.
+    """
+    global http_client, validator_cache, details_cache, change_history, replaying
+    global circuit_breaker
+    v(LOG_REPLAY.format(snapshot))
+    replaying = True
+    http_client = snapshots.ReplayClient(get_snapshot_archive(), snapshot)
+    known_stores.clear()
+    validator_cache = cache.ValidatorCache(":memory:")
+    details_cache = cache.DetailsCache(":memory:")
+    change_history = scheduler.ChangeHistory(":memory:")
+    circuit_breaker = retry.CircuitBreaker(":memory:")
+
+
+def get_http_client():
+    """
+    Return the crawl-wide HTTP client, creating it on first use. All fetches share its
+    connection pools, headers and cookies, and the per-host politeness limits.
+    """
+    global http_client
+    with http_client_lock:
+        if http_client is None:
+            http_client = fetch.Client(
+                HEADERS,
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE,
+                connect_context=lambda: profiler.phase("connect"),
+                limiter=fetch.HostLimiter(
+                    rate=REQUESTS_PER_SECOND,
+                    burst=REQUEST_BURST,
+                    concurrency=MAX_REQUESTS_PER_HOST,
+                    rates=HOST_REQUESTS_PER_SECOND,
+                    max_wait=MAX_BACK_OFF_WAIT,
+                    wait_context=lambda: profiler.phase("rate-limit"),
+                ),
+            )
+        return http_client
 
 
 def format_mail(results):
@@ -303,12 +1392,31 @@ def format_mail(results):
     return EMAIL_SUBJECT.format(offers_count), text
 
 
-def send_mail(subject, text):
+def send_mail(subject, text, recipients=RECIPIENTS):
     """
-    Send an email to the configured recipients containing the given subject and content.
+    Queue an email to the *recipients* (by default the ones in `config.py`) containing
+    the given subject and content. It is sent in the background, see
+    :py:func:`get_notifier`.
     """
-    mail = sendmail.Mail(RECIPIENTS[0], subject, text, bcc=RECIPIENTS[1:])
-    mail.send()
+    mail = sendmail.Mail(recipients[0], subject, text, bcc=recipients[1:])
+    get_notifier().submit(mail)
+
+
+def get_notifier():
+    """
+    Return the notifier sending queued emails in the background, starting it on first
+    use. Emails left in OUTBOX_PATH by previous runs are sent first.
+    """
+    global notifier
+    with notifier_lock:
+        if notifier is None:
+            notifier = notify.Notifier(
+                OUTBOX_PATH,
+                on_sent=lambda subject: v(LOG_EMAIL_SENT.format(subject)),
+                on_error=lambda error: err(LOG_EMAIL_FAILED.format(error)),
+                send_context=lambda: profiler.phase("smtp"),
+            )
+        return notifier
 
 
 def format_code(code):
@@ -328,34 +1436,32 @@ def truncate(string, max_len):
     return string[: max_len - 3] + "..." if len(string) > max_len else string
 
 
-def debug_dump_site_html(name, html):
-    dump_sites_path = Path("debug-sites")
-    dump_sites_path.mkdir(parents=True, exist_ok=True)
-    site_debug_path = dump_sites_path / f"sites-{name}.html"
-    with site_debug_path.open("w") as site_dump:
-        print(html, file=site_dump)
-
-
 def v(*msg):
     if VERBOSITY > 0 and not QUIET:
-        print(*msg)
+        with print_lock:
+            print(*msg)
 
 
 def vv(*msg):
     if VERBOSITY > 1 and not QUIET:
-        print(*msg)
+        with print_lock:
+            print(*msg)
 
 
 def err(*msg):
     if not QUIET:
-        print(*msg, file=sys.stderr)
+        with print_lock:
+            print(*msg, file=sys.stderr)
 
 
-def service_file(user_param=False):
+def service_file(user_param=False, daemon=False):
     """
     Create a systemd unit file. If *user_param* is True, output will be an
-    @-parameterized service file that runs as the given user.
+    @-parameterized service file that runs as the given user. If *daemon* is True, the
+    service runs the crawler in daemon mode, which needs no timer, and is restarted if
+    it fails.
     """
+    restart = "\nRestart=on-failure\nRestartSec=60" if daemon else ""
     return f"""\
 [Unit]
 Description=Check various websites for new flat exposes{" for %I" if user_param else ""}
@@ -363,9 +1469,9 @@ After=network-online.target nss-lookup.target
 
 [Service]
 Type=simple
-ExecStart=/usr/bin/python3 -u "{os.path.realpath(__file__)}"
+ExecStart=/usr/bin/python3 -u "{os.path.realpath(__file__)}"{" daemon" if daemon else ""}
 WorkingDirectory={os.path.dirname(os.path.realpath(__file__))}
-{"User=%i" if user_param else ""}
+{"User=%i" if user_param else ""}{restart}
 
 [Install]
 WantedBy=multi-user.target"""
@@ -415,14 +1521,28 @@ if __name__ == "__main__":
     parser.add_argument(
         "systemd",
         nargs="?",
-        choices=["service", "service@", "timer", "install", "run"],
+        choices=[
+            "service",
+            "service@",
+            "daemon-service",
+            "timer",
+            "install",
+            "run",
+            "daemon",
+            "worker",
+            "stats",
+        ],
         default=None,
         help=(
             "Print a systemd unit file of the specified type."
             " Use 'service@' to print a service file that allows a User parameter."
+            " Use 'daemon-service' to print a service file for daemon mode."
             " Use 'install' to create the service and timer in"
             " ~/.local/share/systemd/user/. Use 'run' to install, start and enable"
-            " the timer, all in one command."
+            " the timer, all in one command. Use 'daemon' to keep running and check"
+            " each site on its own interval instead of once. Use 'worker' to check"
+            " shards of sites for a crawl run with --workers. Use 'stats' to print"
+            " how long offers stayed online on each site."
         ),
     )
     parser.add_argument(
@@ -442,19 +1562,86 @@ if __name__ == "__main__":
     parser.add_argument(
         "--include-known", action="store_true", help="Include known results"
     )
+    parser.add_argument(
+        "--replay",
+        metavar="SNAPSHOT",
+        help=(
+            f"Read all pages from a snapshot in {SNAPSHOTS_PATH}/ instead of the"
+            " network ('latest' for the newest one), and print the email"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each phase of each site at the end",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        metavar="FILE",
+        help="Write the time spent in each phase to FILE, in Chrome trace format",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=MAX_CONCURRENT_SITES,
+        help=f"Check at most this many sites at once (default {MAX_CONCURRENT_SITES})",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=RUN_DEADLINE,
+        metavar="SECONDS",
+        help=(
+            "Give up on sites not checked within this many seconds of the start of a"
+            f" crawl, 0 for no limit (default {RUN_DEADLINE or 0:.0f})"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Split the sites into this many shards, checked by as many workers",
+    )
+    parser.add_argument(
+        "--queue",
+        default=WORK_QUEUE_DB,
+        help=f"Work queue database of --workers and 'worker' (default {WORK_QUEUE_DB})",
+    )
+    parser.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="Let 'worker' exit once there are no shards left, instead of waiting",
+    )
     args = parser.parse_args()
     VERBOSITY = args.verbose or 0
     QUIET = args.quiet or False
+    if args.profile or args.profile_trace:
+        profiler = profiling.Profiler()
     if args.systemd == "service":
         print(service_file())
     elif args.systemd == "service@":
         print(service_file(user_param=True))
+    elif args.systemd == "daemon-service":
+        print(service_file(daemon=True))
     elif args.systemd == "timer":
         print(timer_file())
     elif args.systemd == "install":
         sys.exit(install())
     elif args.systemd == "run":
         sys.exit(install(run=True))
+    elif args.systemd == "worker":
+        try:
+            sys.exit(work(args))
+        except KeyboardInterrupt:
+            sys.exit(0)
+    elif args.systemd == "stats":
+        print(offer_stats())
+    elif args.systemd == "daemon":
+        try:
+            daemon(args)
+        except KeyboardInterrupt:
+            sys.exit(0)
     else:
         try:
             sys.exit(main(args))
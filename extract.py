@@ -0,0 +1,268 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Compiled extraction plans for the patterns configured in `sites.py`.
+
+An `ExtractionPlan` is built once per site config. It holds the compiled
+`expose-url-pattern` and `expose-details` patterns, and validates their group counts,
+so that a broken site config fails on startup instead of in the middle of a crawl.
+
+Most patterns start with a literal string, like `<div class="detail-label">Etage</div>`.
+Any match has to start at an occurrence of that literal prefix, so the plan looks the
+prefix up with a plain substring search first, and only runs the regex from there on.
+Documents where the prefix doesn't occur aren't regex-scanned at all. The results are
+the same as with `re.search()`/`re.findall()` on the whole document.
+
+The optional pagination patterns `next-page-pattern` and `page-count-pattern` are
+compiled the same way, as are the `listing-details` patterns, which extract details of
+each offer from its entry on the listing page.
+
+Sites without a `success-str` are recognized by a fingerprint of their text instead.
+If `fingerprint-start` (and `fingerprint-end`) are configured, only the text between
+these markers is used, extracted with a simple regex tokenizer instead of a full parse.
+"""
+import re
+from hashlib import sha1
+from html import unescape
+
+REGEX_SPECIAL = ".^$*+?{}[]|()"
+QUANTIFIERS = "*+?{"
+NON_TEXT = re.compile(
+    r"<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->|<[^>]*>",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+class ExtractionPlan:
+    """
+    The compiled patterns of a site *config* dict. `expose_urls` is None if the site has
+    no `expose-url-pattern`, `details` is None if it has no `expose-details`, and
+    likewise for `next_page` and `page_count`.
+    """
+
+    def __init__(self, config):
+        self.name = config.get("name")
+        self.fingerprint_start = config.get("fingerprint-start")
+        self.fingerprint_end = config.get("fingerprint-end")
+        self.expose_urls = self.group_pattern(config, "expose-url-pattern")
+        self.next_page = self.group_pattern(config, "next-page-pattern")
+        self.page_count = self.group_pattern(config, "page-count-pattern")
+        self.page_size = config.get("page-size")
+        details = config.get("expose-details")
+        self.details = DetailsPlan(details) if details else None
+        listing_details = config.get("listing-details")
+        self.listing_details = DetailsPlan(listing_details) if listing_details else None
+        self.entry_str = config.get("listing-entry-str")
+
+    def group_pattern(self, config, key):
+        """
+        Return the compiled pattern *key* of *config*, or None if it isn't configured.
+        Raises ValueError if it has more than one group.
+        """
+        regex = config.get(key)
+        if regex is None:
+            return None
+        pattern = AnchoredPattern(regex)
+        if pattern.pattern.groups > 1:
+            raise ValueError(
+                f"{self.name}: {key} must have at most one group,"
+                f" has {pattern.pattern.groups}"
+            )
+        return pattern
+
+    def find_expose_urls(self, text):
+        """Return all (possibly relative) exposé urls in *text*."""
+        return self.expose_urls.findall(text)
+
+    def find_listing_entries(self, text):
+        """
+        Return a list of (url, details) tuples for all (possibly relative) exposé urls
+        in *text*, in order and without duplicates. The details dict holds the
+        `listing-details` found in the url's entry on the listing page: the part of
+        *text* starting with the `listing-entry-str` before the url, or without it,
+        from the url up to the next one.
+        """
+        if self.listing_details is None:
+            return [(url, {}) for url in dict.fromkeys(self.find_expose_urls(text))]
+        matches = list(self.expose_urls.finditer(text))
+        found = {}
+        for index, match in enumerate(matches):
+            if self.entry_str is not None:
+                begin = text.rfind(self.entry_str, 0, match.start())
+                begin = match.start() if begin < 0 else begin
+                end = text.find(self.entry_str, match.end())
+                end = len(text) if end < 0 else end
+            else:
+                begin = match.start()
+                end = matches[index + 1].start() if index + 1 < len(matches) else None
+            details = found.setdefault(match.group(match.re.groups), {})
+            for key, value in self.listing_details.extract(text, begin, end).items():
+                details.setdefault(key, value)
+        return list(found.items())
+
+    def find_next_page(self, text):
+        """Return the (possibly relative) url of the next page in *text*, or None."""
+        match = self.next_page.search(text) if self.next_page else None
+        return unescape(match.group(match.re.groups)) if match else None
+
+    def find_page_count(self, text):
+        """
+        Return the number of pages according to *text*, or None if it isn't found. With
+        `page-size`, the pattern matches the total number of offers instead.
+        """
+        match = self.page_count.search(text) if self.page_count else None
+        if not match:
+            return None
+        digits = re.sub(r"\D", "", match.group(match.re.groups))
+        if not digits:
+            return None
+        count = int(digits)
+        return -(-count // self.page_size) if self.page_size else count
+
+    def fingerprint(self, html):
+        """
+        Return a hex digest of the text of *html*. If a fingerprint region is
+        configured, only the whitespace-normalized text within it is used. If the region
+        can't be found, the whole page is used, so that the change gets noticed.
+        """
+        if self.fingerprint_start is None and self.fingerprint_end is None:
+            from bs4 import BeautifulSoup  # slow to import, and rarely needed
+
+            return sha1(
+                BeautifulSoup(html, "html.parser").get_text().encode()
+            ).hexdigest()
+        region = find_region(html, self.fingerprint_start, self.fingerprint_end)
+        return sha1(page_text(html if region is None else region).encode()).hexdigest()
+
+
+class DetailsPlan:
+    """
+    The compiled `expose-details` patterns, from a mapping of keys to regexes. `key`
+    identifies the patterns, e.g. to tell details extracted with other patterns apart.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.patterns = {key: AnchoredPattern(regex) for key, regex in config.items()}
+        self.key = sha1(repr(sorted(config.items())).encode()).hexdigest()
+
+    def extract(self, text, start=0, end=None):
+        """
+        Return a dict of all keys whose pattern matches in *text* (between the positions
+        *start* and *end*, if given). Values are the stripped match groups, joined with
+        spaces.
+        """
+        details = {}
+        for key, pattern in self.patterns.items():
+            match = pattern.search(text, start, end)
+            if match:
+                details[key] = " ".join(match.groups("")).strip()
+        return details
+
+
+class AnchoredPattern:
+    """A compiled regex, which starts scanning at the first possible match position."""
+
+    def __init__(self, regex):
+        self.pattern = re.compile(regex)
+        self.prefix = literal_prefix(regex)
+
+    def start(self, text, start=0, end=None):
+        """Return where the first match could start in *text*, or -1 if nowhere."""
+        return text.find(self.prefix, start, end) if self.prefix else start
+
+    def search(self, text, start=0, end=None):
+        start = self.start(text, start, end)
+        if start < 0:
+            return None
+        return self.pattern.search(text, start, len(text) if end is None else end)
+
+    def findall(self, text):
+        start = self.start(text)
+        return self.pattern.findall(text, start) if start >= 0 else []
+
+    def finditer(self, text):
+        start = self.start(text)
+        return self.pattern.finditer(text, start) if start >= 0 else iter(())
+
+
+def literal_prefix(regex):
+    """
+    Return the literal string every match of *regex* has to start with. Returns an
+    empty string if there is none, or it can't be determined safely.
+    """
+    if regex.startswith("(?") or has_top_level_branch(regex):
+        return ""
+    prefix = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            if i + 1 >= len(regex) or regex[i + 1].isalnum():
+                break
+            char = regex[i + 1]
+            i += 2
+        elif char in REGEX_SPECIAL:
+            break
+        else:
+            i += 1
+        if i < len(regex) and regex[i] in QUANTIFIERS:
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+def has_top_level_branch(regex):
+    """Return True if *regex* contains a `|` outside of any group or character set."""
+    depth = 0
+    in_set = False
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            i += 1
+        elif in_set:
+            in_set = char != "]"
+        elif char == "[":
+            in_set = True
+            if regex[i + 1 : i + 2] == "^":
+                i += 1
+            if regex[i + 1 : i + 2] == "]":
+                i += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def find_region(html, start=None, end=None):
+    """
+    Return the part of *html* after the marker *start* and up to the following marker
+    *end*. Either marker may be None, for the beginning or end of the document. Returns
+    None if a marker isn't found.
+    """
+    begin = 0
+    if start is not None:
+        begin = html.find(start)
+        if begin < 0:
+            return None
+        begin += len(start)
+    if end is None:
+        return html[begin:]
+    finish = html.find(end, begin)
+    return html[begin:finish] if finish >= 0 else None
+
+
+def page_text(html):
+    """Return the whitespace-normalized text of *html*, without scripts and styles."""
+    return " ".join(unescape(NON_TEXT.sub(" ", html)).split())
+
+
+def compile_plans(configs):
+    """Return an `ExtractionPlan` for each of the site *configs*."""
+    return [ExtractionPlan(config) for config in configs]
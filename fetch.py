@@ -0,0 +1,492 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+The HTTP client layer used for all fetches of a crawl.
+
+A `Client` wraps a single `requests.Session`, which keeps a pool of keep-alive
+connections per host, so that all listing pages and exposés on the same host share one
+TCP+TLS handshake. Default headers and cookies are shared by all requests as well.
+
+>>> client = Client({"User-Agent": "flatcrawler"})
+>>> client.get("https://www.degewo.de/").ok
+True
+
+With a `HostLimiter`, the client is polite to each host: requests are paced with a
+token bucket per host, the number of concurrent requests per host is capped, and "429
+Too Many Requests" and "503 Service Unavailable" responses make it back off from the
+host for as long as their `Retry-After` header asks:
+
+>>> client = Client(limiter=HostLimiter(rate=1, burst=3, concurrency=2))
+
+Requests can be given a *deadline* (a `time.monotonic()` value), by which they have to
+be done, including reading the response. Timeouts are shortened to the time left, and
+`DeadlineExceeded` is raised once it has passed:
+
+>>> client.get(url, timeout=(10, 30), deadline=time.monotonic() + 60)
+
+A `SharedClient` sends identical requests only once, e.g. for sites checked on behalf
+of several profiles within the same crawl:
+
+>>> client = SharedClient(Client())
+>>> client.get(url) is client.get(url)
+True
+"""
+import time
+import codecs
+import weakref
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+STREAM_CHUNK_SIZE = 8 * 1024
+BACK_OFF_STATUS = (429, 503)
+BACK_OFF_DEFAULT = 30  # seconds to back off if a 429/503 has no Retry-After header
+MAX_WAIT = 60  # back-offs up to this many seconds are waited out, longer ones fail
+
+
+class RateLimited(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host that asked to back off longer."""
+
+    def __init__(self, url, seconds):
+        super().__init__(f"{urlsplit(url).netloc} asked to back off for {seconds:.0f}s")
+        self.url = url
+        self.seconds = seconds
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when a request for *url* isn't done by its deadline."""
+
+    def __init__(self, url):
+        super().__init__(f"{url} not done by the deadline")
+        self.url = url
+
+
+class Client:
+    """
+    A pooled HTTP client. Takes default *headers* sent with every request, the number
+    of hosts to keep connection pools for (*pool_connections*), and the number of
+    connections kept alive per host (*pool_maxsize*). If given, every new connection
+    (DNS lookup, TCP and TLS handshake) is made within the context manager returned by
+    calling *connect_context*, e.g. for timing. All requests pass the *limiter*, a
+    `HostLimiter`, if given.
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        connect_context=None,
+        limiter=None,
+    ):
+        self.limiter = limiter
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = ConnectContextAdapter(
+            connect_context,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, deadline=None, **kwargs):
+        """
+        Send a GET request for *url*, *kwargs* are passed on to `requests`. If the
+        host responds with 429 or 503, the limiter backs off from it, and the request
+        is repeated once if the back-off is short enough to wait for. Raises
+        `RateLimited` if the host is still backed off from for longer. Streamed
+        responses keep their slot of the limiter until they are closed. With a
+        *deadline*, raises `DeadlineExceeded` if the request (and reading the response,
+        unless streamed) isn't done by then.
+        """
+        if self.limiter is None:
+            return self.send(url, deadline, kwargs)
+        for retry in (True, False):
+            release = self.limiter.acquire(url)
+            try:
+                response = self.send(url, deadline, kwargs)
+            except BaseException:
+                release()
+                raise
+            if kwargs.get("stream") and response.status_code not in BACK_OFF_STATUS:
+                release_on_close(response, release)
+            else:
+                release()
+            if response.status_code not in BACK_OFF_STATUS:
+                break
+            seconds = retry_after(response)
+            self.limiter.back_off(url, seconds)
+            if not retry or seconds > self.limiter.max_wait:
+                break
+            response.close()
+        return response
+
+    def send(self, url, deadline, kwargs):
+        """Send the request for `get()`, within the *deadline* if given."""
+        if deadline is None:
+            return self.session.get(url, **kwargs)
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceeded(url)
+        kwargs = dict(kwargs)
+        connect = read = kwargs.pop("timeout", None)
+        if isinstance(connect, tuple):
+            connect, read = connect
+        stream = kwargs.pop("stream", False)
+        response = self.session.get(
+            url,
+            timeout=(min(connect or left, left), min(read or left, left)),
+            stream=True,
+            **kwargs,
+        )
+        if not stream:
+            read_by(response, deadline)
+        return response
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+def read_by(response, deadline):
+    """
+    Read the whole body of the streamed *response*, so that it is available as
+    `response.content` (and `text`) afterwards. Raises `DeadlineExceeded` if reading
+    isn't done by the `time.monotonic()` value *deadline*.
+    """
+    chunks = []
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        chunks.append(chunk)
+        if time.monotonic() > deadline:
+            response.close()
+            raise DeadlineExceeded(response.url)
+    response._content = b"".join(chunks)  # what `response.content` would have read
+
+
+def release_on_close(response, release):
+    """
+    Call *release* once the streamed *response* is closed, or garbage collected
+    without that.
+    """
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+
+    response.close = close_and_release
+    weakref.finalize(response, release)
+
+
+class ConnectContextAdapter(HTTPAdapter):
+    """An `HTTPAdapter` that opens new connections within *connect_context()*."""
+
+    def __init__(self, connect_context=None, **kwargs):
+        self.connect_context = connect_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.connect_context is not None:
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": connect_context_pool(HTTPConnectionPool, self.connect_context),
+                "https": connect_context_pool(
+                    HTTPSConnectionPool, self.connect_context
+                ),
+            }
+
+
+def connect_context_pool(pool_class, connect_context):
+    """Return a subclass of *pool_class* whose connections connect within a context."""
+
+    class ConnectContextConnection(pool_class.ConnectionCls):
+        def connect(self):
+            with connect_context():
+                return super().connect()
+
+    return type(
+        pool_class.__name__, (pool_class,), {"ConnectionCls": ConnectContextConnection}
+    )
+
+
+class SharedClient:
+    """
+    Wraps a *client* with the interface of `Client`, and sends requests for the same
+    url with the same headers only once. Responses are kept as long as the
+    `SharedClient`, so use a new one for each crawl. Concurrent requests wait for the
+    first one. Responses are read completely, so they can be read (or streamed) by all
+    requesters. Errors are raised for all concurrent requesters, but errors and error
+    responses aren't kept, so that retries are sent again. Counts `hits` (requests that
+    weren't sent).
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.responses = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, **kwargs):
+        """Return the response for *url*, see `Client.get()`. *stream* is ignored."""
+        key = (url, frozenset((headers or {}).items()))
+        with self.lock:
+            response = self.responses.get(key)
+            first = response is None
+            if first:
+                response = self.responses[key] = Future()
+            else:
+                self.hits += 1
+        if first:
+            try:
+                result = self.client.get(url, headers=headers, **kwargs)
+                result.content
+            except BaseException as error:
+                self.drop(key, response)
+                response.set_exception(error)
+                raise
+            if not result.ok:
+                self.drop(key, response)
+            response.set_result(result)
+        return response.result()
+
+    def drop(self, key, response):
+        with self.lock:
+            if self.responses.get(key) is response:
+                del self.responses[key]
+
+
+class HostLimiter:
+    """
+    Politeness limits per host. Requests to a host are paced to *rate* per second on
+    average, with bursts of up to *burst* requests (a token bucket), and at most
+    *concurrency* of them are sent (and their responses read) at the same time. *rates*
+    maps host names to their own rate. A rate of 0 or None doesn't pace the host at
+    all.
+
+    After `back_off()`, no requests are sent to a host for the given time. Requests
+    wait for back-offs of up to *max_wait* seconds, and raise `RateLimited` for
+    longer ones. Waiting (for tokens or back-offs) is done within the context manager
+    returned by calling *wait_context*, if given, e.g. for timing.
+
+    >>> limiter = HostLimiter(rate=2, burst=4, concurrency=4)
+    >>> with limiter("https://www.degewo.de/de/properties/W1"):
+    ...     session.get("https://www.degewo.de/de/properties/W1")
+    """
+
+    class Host:
+        __slots__ = ("rate", "burst", "tokens", "updated", "paused_until", "slots")
+
+        def __init__(self, rate, burst, concurrency, now):
+            self.rate = rate
+            self.burst = burst
+            self.tokens = burst
+            self.updated = now
+            self.paused_until = now
+            self.slots = threading.BoundedSemaphore(concurrency)
+
+    def __init__(
+        self,
+        rate=None,
+        burst=1,
+        concurrency=4,
+        rates=None,
+        max_wait=MAX_WAIT,
+        wait_context=None,
+        clock=time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.rates = rates or {}
+        self.max_wait = max_wait
+        self.wait_context = wait_context
+        self.clock = clock
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, url):
+        """Wait until a request to the host of *url* may be sent, and send it within."""
+        release = self.acquire(url)
+        try:
+            yield
+        finally:
+            release()
+
+    def acquire(self, url):
+        """
+        Wait until a request to the host of *url* may be sent, and take one of the
+        host's slots. Returns a function that frees the slot again, once the request
+        (including reading its response) is done. Calling it again has no effect.
+        """
+        host = self.host(url)
+        host.slots.acquire()
+        try:
+            self.wait(url, host)
+        except BaseException:
+            host.slots.release()
+            raise
+        taken = threading.Lock()
+
+        def release():
+            if taken.acquire(blocking=False):
+                host.slots.release()
+
+        return release
+
+    def host(self, url):
+        """Return the state of the host of *url*, creating it on first use."""
+        name = urlsplit(url).netloc
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = self.Host(
+                    self.rates.get(name, self.rate),
+                    self.burst,
+                    self.concurrency,
+                    self.clock(),
+                )
+            return self.hosts[name]
+
+    def wait(self, url, host):
+        """Block until *host* is neither backed off from nor out of tokens, take one."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                delay = host.paused_until - now
+                if delay > self.max_wait:
+                    raise RateLimited(url, delay)
+                if delay <= 0:
+                    if not host.rate:
+                        return
+                    host.tokens = min(
+                        host.burst, host.tokens + (now - host.updated) * host.rate
+                    )
+                    host.updated = now
+                    if host.tokens >= 1:
+                        host.tokens -= 1
+                        return
+                    delay = (1 - host.tokens) / host.rate
+            if self.wait_context is None:
+                time.sleep(delay)
+            else:
+                with self.wait_context():
+                    time.sleep(delay)
+
+    def back_off(self, url, seconds):
+        """Don't send any requests to the host of *url* for *seconds*."""
+        host = self.host(url)
+        with self.lock:
+            now = self.clock()
+            host.paused_until = max(host.paused_until, now + seconds)
+            host.tokens = 0
+            host.updated = host.paused_until
+
+
+def retry_after(response, default=BACK_OFF_DEFAULT):
+    """
+    Return the seconds to wait according to the `Retry-After` header of *response*
+    (either seconds or an HTTP date), or *default* if it has none or it's invalid.
+    """
+    value = response.headers.get("Retry-After", "").strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return default
+    if when is None:
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class StreamScanner:
+    """
+    Reads a response that was requested with `stream=True` incrementally, and stops as
+    soon as one of a list of marker strings has been found. Markers spanning chunk
+    boundaries are found as well.
+
+    >>> scanner = StreamScanner(client.get(url, stream=True))
+    >>> scanner.read_until("no offers", "offers found")
+    'no offers'
+    >>> scanner.close()
+
+    With a *deadline* (a `time.monotonic()` value), reading raises `DeadlineExceeded`
+    once it has passed.
+    """
+
+    def __init__(self, response, chunk_size=STREAM_CHUNK_SIZE, deadline=None):
+        self.response = response
+        self.deadline = deadline
+        self.complete = False
+        self.chunks = []
+        self.raw_chunks = []
+        self.raw_chunk_iter = response.iter_content(chunk_size)
+        self.decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+            errors="replace"
+        )
+
+    @property
+    def text(self):
+        """The text read so far."""
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    @property
+    def size(self):
+        """The number of raw bytes read so far."""
+        return sum(len(raw_chunk) for raw_chunk in self.raw_chunks)
+
+    @property
+    def content(self):
+        """The complete raw content, or None if the response wasn't read completely."""
+        return b"".join(self.raw_chunks) if self.complete else None
+
+    def read_until(self, *markers, start=0):
+        """
+        Read until any of *markers* (None entries are ignored) is found in the text
+        after position *start*, and return it. Markers are tried in the given order, so
+        if several are found within the same chunk, the first one given wins. Reads
+        until the end and returns None if no marker is found, or none were given.
+        """
+        markers = [marker for marker in markers if marker]
+        overlap = max([len(marker) for marker in markers], default=1) - 1
+        window = self.text[start:]
+        while True:
+            for marker in markers:
+                if marker in window:
+                    return marker
+            if not self.read_chunk():
+                return None
+            window = (window[-overlap:] if overlap else "") + self.chunks[-1]
+
+    def read_chunk(self):
+        """Read the next chunk, returns False if the response is complete."""
+        if self.complete:
+            return False
+        raw_chunk = next(self.raw_chunk_iter, None)
+        if raw_chunk is None:
+            self.complete = True
+            self.chunks.append(self.decoder.decode(b"", final=True))
+            return False
+        self.raw_chunks.append(raw_chunk)
+        self.chunks.append(self.decoder.decode(raw_chunk))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded(self.response.url)
+        return True
+
+    def close(self):
+        """Close the connection, dropping any unread content."""
+        self.response.close()
@@ -0,0 +1,161 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Typed offer records, and filtering them by the flat criteria in `config.py`.
+
+An `OfferRecord` holds the values parsed from the raw detail strings of an offer, as
+extracted from its listing page entry (`listing-details`) or its exposé
+(`expose-details`). Numbers are parsed in German notation:
+
+>>> record = OfferRecord("https://www.degewo.de/de/properties/W1")
+>>> record.update({"rooms": "2", "total_rent": "1.234,56", "floor": "3. OG"})
+>>> record.total_rent, record.floor
+(1234.56, 3)
+
+`Criteria` checks records against the criteria. Values that are unknown (not
+configured, or not found for the offer) never exclude an offer:
+
+>>> Criteria(rent_max=1000).matches(record)
+False
+"""
+import re
+
+NUMBER = re.compile(r"\d[\d.]*(?:,\d+)?")
+THOUSANDS = re.compile(r"\d{1,3}(?:\.\d{3})+")
+GROUND_FLOOR = re.compile(r"\b(?:eg|erdgeschoss|hochparterre|parterre)\b")
+BASEMENT = re.compile(r"\b(?:ug|souterrain|untergeschoss)\b")
+NO = re.compile(r"\b(?:nein|nicht|kein|keine|ohne|no|false)\b")
+YES = re.compile(r"\b(?:ja|erforderlich|notwendig|benötigt|yes|true)\b")
+CRITERIA = (
+    "rooms_min",
+    "rooms_max",
+    "area_min",
+    "area_max",
+    "rent_max",
+    "floor_min",
+    "floor_max",
+    "wbs",
+)
+
+
+class OfferRecord:
+    """The typed values of an offer at *url*. Unknown values are None."""
+
+    __slots__ = ("url", "title", "rent", "total_rent", "area", "rooms", "floor", "wbs")
+
+    def __init__(self, url):
+        self.url = url
+        self.title = None
+        self.rent = None
+        self.total_rent = None
+        self.area = None
+        self.rooms = None
+        self.floor = None
+        self.wbs = None
+
+    def update(self, details):
+        """
+        Parse the values from a dict of raw *details*, as extracted with the keys used
+        in `sites.py`. Values that are missing or can't be parsed are kept.
+        """
+        parsers = (
+            ("title", "title", str.strip),
+            ("price", "rent", parse_number),
+            ("total_rent", "total_rent", parse_number),
+            ("area", "area", parse_number),
+            ("rooms", "rooms", parse_number),
+            ("floor", "floor", parse_floor),
+            ("wbs", "wbs", parse_yes_no),
+        )
+        for key, attribute, parse in parsers:
+            value = parse(details[key]) if details.get(key) else None
+            if value is not None:
+                setattr(self, attribute, value)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"OfferRecord({values})"
+
+
+class Criteria:
+    """
+    Flat criteria, named like in `config.py`. The rent is compared to *rent_max* as the
+    total rent if known, else the net rent. With `wbs=False`, offers that require a
+    Wohnberechtigungsschein are excluded.
+    """
+
+    __slots__ = CRITERIA
+
+    def __init__(self, **criteria):
+        for name in CRITERIA:
+            setattr(self, name, criteria.pop(name, None))
+        if criteria:
+            raise TypeError(f"unknown criteria: {', '.join(criteria)}")
+
+    @classmethod
+    def from_module(cls, module):
+        """Return the criteria defined in *module*, e.g. `config`."""
+        return cls(**{name: getattr(module, name, None) for name in CRITERIA})
+
+    def matches(self, record):
+        """Return False if any known value of *record* violates the criteria."""
+        rent = record.total_rent if record.total_rent is not None else record.rent
+        return (
+            within(record.rooms, self.rooms_min, self.rooms_max)
+            and within(record.area, self.area_min, self.area_max)
+            and within(rent, None, self.rent_max)
+            and within(record.floor, self.floor_min, self.floor_max)
+            and not (self.wbs is False and record.wbs)
+        )
+
+
+def within(value, minimum, maximum):
+    """Return True unless *value* is known and outside of the known bounds."""
+    if value is None:
+        return True
+    return (minimum is None or value >= minimum) and (
+        maximum is None or value <= maximum
+    )
+
+
+def parse_number(text):
+    """
+    Return the first number in *text* as a float, e.g. 1234.56 for "1.234,56 €", or
+    None if there is none. A dot followed by three digits is read as a thousands
+    separator, any other dot as a decimal point.
+    """
+    match = NUMBER.search(text)
+    if not match:
+        return None
+    number = match.group().rstrip(".")
+    if "," in number or THOUSANDS.fullmatch(number):
+        number = number.replace(".", "").replace(",", ".")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def parse_floor(text):
+    """
+    Return the floor number in *text*, e.g. 3 for "3. OG" or "3 / 5", 0 for the ground
+    floor and -1 for the basement, or None if there is none.
+    """
+    lower = text.lower()
+    if GROUND_FLOOR.search(lower):
+        return 0
+    if BASEMENT.search(lower):
+        return -1
+    match = re.search(r"-?\d+", lower)
+    return int(match.group()) if match else None
+
+
+def parse_yes_no(text):
+    """Return True or False for a German yes/no *text*, or None if it's neither."""
+    lower = text.lower()
+    if NO.search(lower):
+        return False
+    if YES.search(lower):
+        return True
+    return None
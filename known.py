@@ -0,0 +1,210 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+A store of known offers, so that each offer is only reported once.
+
+Keys (usually exposé urls) are kept in an SQLite database in WAL mode, which gives
+exact-key lookups via the primary key index and lets overlapping crawler runs read and
+write the store at the same time. New keys are buffered and written in a single
+transaction per run by `flush()`.
+
+>>> store = KnownStore("known.db")
+>>> store.check_and_add("https://example.com/expose/1")
+True
+>>> store.check_and_add("https://example.com/expose/1")
+False
+>>> store.close()
+
+The store also tracks the lifecycle of each offer: the site it was found on, when it was
+first and last seen, and when it disappeared. After checking a site's complete listing,
+pass the keys found on it to `listing()`: known keys of that site that weren't found are
+marked as disappeared. Entries that disappeared (or weren't seen) longer ago than a
+retention period are deleted by `expire()`, which keeps the store bounded, and
+`lifetimes()` tells how long offers stayed online per site.
+
+Older versions kept a plain `known.txt` file with one key per line. Use
+`import_file()` to copy its contents into the store once.
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+LIFECYCLE_COLUMNS = {
+    "site": "TEXT",
+    "first_seen": "REAL",
+    "last_seen": "REAL",
+    "disappeared": "REAL",
+}
+
+
+class KnownStore:
+    """A set of known keys, persisted to the SQLite database at *path*."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = {}
+        self.seen = {}
+        self.listings = {}
+        self.touched = set()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS known (key TEXT PRIMARY KEY)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(known)")}
+            for column, column_type in LIFECYCLE_COLUMNS.items():
+                if column not in columns:
+                    self.db.execute(
+                        f"ALTER TABLE known ADD COLUMN {column} {column_type}"
+                    )
+            now = time.time()
+            self.db.execute(
+                "UPDATE known SET first_seen = ?, last_seen = ?"
+                " WHERE last_seen IS NULL",
+                (now, now),
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS known_site ON known (site, disappeared)"
+            )
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.pending or self._stored(key)
+
+    def _stored(self, key):
+        return (
+            self.db.execute("SELECT 1 FROM known WHERE key = ?", (key,)).fetchone()
+            is not None
+        )
+
+    def check_and_add(self, key, site=None):
+        """
+        Return True if *key* wasn't known yet, and remember it from now on. Either way,
+        *key* is recorded as seen now on *site*.
+        """
+        now = time.time()
+        with self.lock:
+            if key in self.pending or self._stored(key):
+                self.seen[key] = (site, now)
+                return False
+            self.pending[key] = (site, now)
+            return True
+
+    def listing(self, site, keys):
+        """
+        Record the complete set of *keys* currently listed on *site*. On the next
+        flush, all other keys of *site* are marked as disappeared.
+        """
+        with self.lock:
+            self.listings[site] = set(keys)
+
+    def touch(self, site):
+        """Record all keys of *site* that haven't disappeared as seen now."""
+        with self.lock:
+            self.touched.add(site)
+
+    def flush(self):
+        """Write all changes since the last flush in a single transaction."""
+        now = time.time()
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO known (key, site, first_seen, last_seen)"
+                    " VALUES (?, ?, ?, ?)",
+                    (
+                        (key, site, when, when)
+                        for key, (site, when) in self.pending.items()
+                    ),
+                )
+                self.db.executemany(
+                    "UPDATE known SET last_seen = ?, disappeared = NULL,"
+                    " site = COALESCE(site, ?) WHERE key = ?",
+                    ((when, site, key) for key, (site, when) in self.seen.items()),
+                )
+                self.db.executemany(
+                    "UPDATE known SET last_seen = ?"
+                    " WHERE site = ? AND disappeared IS NULL",
+                    ((now, site) for site in self.touched),
+                )
+                for site, keys in self.listings.items():
+                    listed = self.db.execute(
+                        "SELECT key FROM known WHERE site = ? AND disappeared IS NULL",
+                        (site,),
+                    ).fetchall()
+                    self.db.executemany(
+                        "UPDATE known SET disappeared = ? WHERE key = ?",
+                        ((now, key) for (key,) in listed if key not in keys),
+                    )
+            self.pending.clear()
+            self.seen.clear()
+            self.touched.clear()
+            self.listings.clear()
+
+    def expire(self, retention, now=None):
+        """
+        Delete all keys that disappeared, or weren't seen, more than *retention* seconds
+        ago. Returns the number of keys deleted.
+        """
+        cutoff = (time.time() if now is None else now) - retention
+        with self.lock, self.db:
+            return self.db.execute(
+                "DELETE FROM known WHERE disappeared < ? OR last_seen < ?",
+                (cutoff, cutoff),
+            ).rowcount
+
+    def lifetimes(self):
+        """
+        Return a dict of sites to the list of seconds each of their disappeared offers
+        was seen online, from first seen to disappeared.
+        """
+        lifetimes = defaultdict(list)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT site, disappeared - first_seen FROM known"
+                " WHERE site IS NOT NULL AND disappeared IS NOT NULL"
+            ).fetchall()
+        for site, lifetime in rows:
+            lifetimes[site].append(lifetime)
+        return dict(lifetimes)
+
+    def import_file(self, path):
+        """
+        Import the keys of a `known.txt` file at *path*, one per line. The import is
+        only done once per file and recorded in the store. Returns the number of keys
+        imported.
+        """
+        path = Path(path)
+        marker = f"imported:{path.resolve()}"
+        with self.lock, self.db:
+            if self.db.execute(
+                "SELECT 1 FROM meta WHERE key = ?", (marker,)
+            ).fetchone():
+                return 0
+            try:
+                with path.open() as known_file:
+                    keys = [(line.strip(),) for line in known_file if line.strip()]
+            except FileNotFoundError:
+                return 0
+            now = time.time()
+            self.db.executemany(
+                "INSERT OR IGNORE INTO known (key, first_seen, last_seen)"
+                " VALUES (?, ?, ?)",
+                ((key, now, now) for (key,) in keys),
+            )
+            self.db.execute("INSERT INTO meta (key, value) VALUES (?, '')", (marker,))
+            return len(keys)
+
+    def close(self):
+        """Flush pending keys and close the database."""
+        self.flush()
+        self.db.close()
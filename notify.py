@@ -0,0 +1,259 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Background delivery of notification emails.
+
+A `Notifier` sends emails in a background thread over a single persistent
+:py:class:`sendmail.Connection`, so that neither connecting and logging in, nor waiting
+between retries holds up a crawl. Each submitted email is written to the *outbox*
+directory first and only deleted once it was sent, so emails that couldn't be sent
+before a crash or shutdown are sent on the next start. Several processes may share the
+outbox: each email is claimed by renaming it before it's sent, so it's sent only once.
+
+>>> notifier = Notifier("outbox")
+>>> notifier.submit(Mail("recipient@example.com", "subject", "hello"))
+>>> notifier.close()  # waits until all emails are sent, or failed
+
+A `Coalescer` collects items (e.g. sites with new offers) as they come in, and passes
+them on to a sink in batches, at most once per *window* seconds. The first item is
+passed on right away, so alerts go out as early as possible without flooding the inbox:
+
+>>> coalescer = Coalescer(60, lambda sites: print(format_mail(sites)))
+>>> for site in crawl(sites):
+...     coalescer.add(site)
+>>> coalescer.close()  # passes on anything left
+"""
+import os
+import json
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from pathlib import Path
+import sendmail
+from snapshots import write_atomic
+
+RETRIES = 5
+BACKOFF = 5  # seconds before the first retry, doubled for each further one
+MAX_BACKOFF = 5 * 60
+CLAIM_SUFFIX = ".sending."  # followed by the id of the process sending the email
+BROKEN_SUFFIX = ".broken"  # stored emails that can't be read
+
+
+class Notifier:
+    """
+    Sends emails from the directory *path* in a background thread, each tried up to
+    *retries* times with exponential *backoff*. Emails that still couldn't be sent
+    stay in *path*, and are tried again with the next submitted email, or on the next
+    start. *on_sent* and *on_error* are called with the subject of a sent email, or the
+    exception of a failed try (or of an email that can't be sent at all). Sending is
+    done within the context manager returned by calling *send_context*, if given, e.g.
+    for timing.
+    """
+
+    def __init__(
+        self,
+        path,
+        connection=None,
+        retries=RETRIES,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        on_sent=None,
+        on_error=None,
+        send_context=None,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.connection = connection or sendmail.Connection()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self.send_context = send_context
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.recover_claims()
+        self.requeue_stored()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, mail):
+        """
+        Store the :py:class:`sendmail.Mail` *mail* and queue it for sending. Emails
+        without a recipient are dropped.
+        """
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+        stored = {
+            "subject": mail.email["msg"]["Subject"],
+            "to": mail.recipients(),
+            "message": str(mail),
+        }
+        if not stored["to"][0]:
+            self.report_error(ValueError("No mail adresses given, no mails sent."))
+            return
+        write_atomic(self.path / name, json.dumps(stored).encode())
+        self.requeue_stored()
+
+    def requeue_stored(self):
+        """Queue all stored emails that aren't queued already."""
+        with self.lock:
+            for path in sorted(self.path.glob("*.json")):
+                if path not in self.queued:
+                    self.queued.add(path)
+                    self.queue.put(path)
+
+    def run(self):
+        while True:
+            path = self.queue.get()
+            try:
+                if path is None:
+                    return
+                self.deliver(path)
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
+                self.queue.task_done()
+
+    def recover_claims(self):
+        """Put back emails claimed by processes that ended before sending them."""
+        for claimed in self.path.glob(f"*.json{CLAIM_SUFFIX}*"):
+            name, _, pid = claimed.name.rpartition(CLAIM_SUFFIX)
+            if pid.isdigit() and not process_alive(int(pid)):
+                try:
+                    claimed.rename(self.path / name)
+                except OSError:
+                    pass  # recovered by another process
+
+    def deliver(self, path):
+        """
+        Try to send the stored email at *path*, return True if it was sent. Emails
+        that another process claimed already are skipped, emails that can't be sent
+        are put back into the outbox.
+        """
+        claimed = path.with_name(f"{path.name}{CLAIM_SUFFIX}{os.getpid()}")
+        try:
+            path.rename(claimed)
+        except OSError:
+            return False  # sent, or being sent, by another process
+        try:
+            stored = json.loads(claimed.read_text())
+        except json.JSONDecodeError as error:
+            self.report_error(error)
+            self.move(claimed, path.with_name(path.name + BROKEN_SUFFIX))
+            return False
+        except OSError as error:
+            self.report_error(error)
+            self.move(claimed, path)
+            return False
+        delay = self.backoff
+        for tries in range(1, self.retries + 1):
+            try:
+                if self.send_context is None:
+                    self.connection.send(stored["to"], stored["message"])
+                else:
+                    with self.send_context():
+                        self.connection.send(stored["to"], stored["message"])
+            except (smtplib.SMTPException, OSError) as error:
+                self.connection.close()
+                self.report_error(error)
+                if tries < self.retries:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+            else:
+                try:
+                    claimed.unlink()
+                except OSError as error:
+                    self.report_error(error)
+                if self.on_sent is not None:
+                    self.on_sent(stored["subject"])
+                return True
+        self.move(claimed, path)
+        return False
+
+    def move(self, source, target):
+        """Rename the stored email *source* to *target*, reporting any error."""
+        try:
+            source.rename(target)
+        except OSError as error:
+            self.report_error(error)
+
+    def report_error(self, error):
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def flush(self):
+        """Block until all queued emails were sent, or failed."""
+        self.queue.join()
+
+    def close(self):
+        """Send all queued emails, then stop the thread and close the connection."""
+        self.queue.put(None)
+        self.thread.join()
+        self.connection.close()
+
+
+def process_alive(pid):
+    """Return whether the process *pid* is running on this machine."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Coalescer:
+    """
+    Passes added items on to *sink* as a list, at most once per *window* seconds.
+    *sink* is called from a timer thread, or from `add()` and `close()`, but never
+    concurrently. *clock* defaults to `time.monotonic()`.
+    """
+
+    def __init__(self, window, sink, clock=time.monotonic):
+        self.window = window
+        self.sink = sink
+        self.clock = clock
+        self.items = []
+        self.last_flush = None
+        self.timer = None
+        self.lock = threading.Lock()
+        self.sink_lock = threading.Lock()
+
+    def add(self, item):
+        """Add *item*, passing it on right away if the window allows, else later."""
+        with self.lock:
+            self.items.append(item)
+            if self.timer is not None:
+                return
+            delay = 0
+            if self.last_flush is not None:
+                delay = self.last_flush + self.window - self.clock()
+            if delay > 0:
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Pass all items collected so far on to the sink, if any."""
+        with self.sink_lock:
+            with self.lock:
+                items, self.items = self.items, []
+                self.timer = None
+                if items:
+                    self.last_flush = self.clock()
+            if items:
+                self.sink(items)
+
+    def close(self):
+        """Pass on any remaining items right away."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+        self.flush()
@@ -0,0 +1,111 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Profiles of several flat-seekers, crawled together.
+
+Each profile is a Python file in the profiles directory, written like `config.py`: the
+flat criteria, the district lists used in `sites.py`, and a `MailConfig` with the
+profile's `recipient` and `bcc_recipients`. Settings left out are taken from
+`config.py` if the profile starts with `from config import *`. The site templates in
+`sites.py` are expanded separately for each profile:
+
+>>> profiles = load("profiles", "known.db")
+>>> [(profile.name, profile.known_path.name) for profile in profiles]
+[('anna', 'known-anna.db'), ('ben', 'known-ben.db')]
+
+`fetch_plan()` groups the sites of all profiles by their listing url, so that sites
+shared by several profiles are checked together, and their pages retrieved only once:
+
+>>> targets = [
+...     (profile, config, plan)
+...     for profile in profiles
+...     for config, plan in zip(profile.site_configs, profile.site_plans)
+... ]
+>>> [len(group) for group in fetch_plan(targets)]
+[2, 2, 1, 1, ...]
+"""
+import sys
+import runpy
+import threading
+import importlib.util
+from pathlib import Path
+import extract
+import filters
+
+SITES_PATH = Path(__file__).parent / "sites.py"
+
+expand_lock = threading.Lock()
+
+
+class Profile:
+    """
+    The profile *name* (None for the default profile from `config.py`), with its
+    *config* module, the *site_configs* expanded for it, and the path of its own known
+    offers database, *known_path*. Plans, criteria and recipients are taken from these.
+    """
+
+    def __init__(self, name, config, site_configs, known_path):
+        self.name = name
+        self.config = config
+        self.site_configs = site_configs
+        self.site_plans = extract.compile_plans(site_configs)
+        self.known_path = known_path
+        self.criteria = filters.Criteria.from_module(config)
+        mail_config = config.MailConfig
+        self.recipients = [mail_config.recipient, *mail_config.bcc_recipients]
+
+    def __repr__(self):
+        return f"Profile({self.name!r})"
+
+
+def load(path, known_path):
+    """
+    Return a `Profile` for each `*.py` file in the directory *path*, sorted by name, or
+    an empty list if there is none. Each profile keeps its known offers next to
+    *known_path*, e.g. in `known-anna.db` for `known.db` and the profile `anna.py`.
+    """
+    known_path = Path(known_path)
+    profiles = []
+    for profile_path in sorted(Path(path).glob("*.py")):
+        name = profile_path.stem
+        spec = importlib.util.spec_from_file_location(f"profile_{name}", profile_path)
+        config = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(config)
+        profiles.append(
+            Profile(
+                name,
+                config,
+                expand_sites(config),
+                known_path.with_name(f"{known_path.stem}-{name}{known_path.suffix}"),
+            )
+        )
+    return profiles
+
+
+def expand_sites(config):
+    """
+    Return the site configs of `sites.py`, with its templates expanded for the criteria
+    and districts in the module *config* instead of `config.py`.
+    """
+    with expand_lock:
+        default_config = sys.modules.get("config")
+        sys.modules["config"] = config
+        try:
+            return runpy.run_path(str(SITES_PATH))["sites"]
+        finally:
+            if default_config is None:
+                del sys.modules["config"]
+            else:
+                sys.modules["config"] = default_config
+
+
+def fetch_plan(targets):
+    """
+    Group *targets*, a list of (profile, site config, plan) tuples, by the url of the
+    site, in order of first appearance. Returns a list of lists of targets.
+    """
+    groups = {}
+    for target in targets:
+        groups.setdefault(target[1]["url"], []).append(target)
+    return list(groups.values())
@@ -0,0 +1,178 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Per-site, per-phase timing of a crawl.
+
+A `Profiler` records how long each phase (connecting, waiting for the response,
+downloading, parsing, ...) took for each site, along with the number of bytes
+transferred. The current site is tracked per thread, so phases deep down in the HTTP
+layer are attributed to the right site:
+
+>>> profiler = Profiler()
+>>> with profiler.site("DeGeWo"):
+...     with profiler.phase("download") as record:
+...         record.bytes += len(response.content)
+>>> print(profiler.table())
+
+`NULL` is a profiler that doesn't record anything, at almost no cost, to be used when
+profiling is turned off.
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+TABLE_HEADER = "{: <50} {: <16} {: >6} {: >10} {: >10} {: >10}".format(
+    "site", "phase", "count", "total s", "max s", "KiB"
+)
+TABLE_ROW = "{: <50} {: <16} {: >6} {: >10.3f} {: >10.3f} {: >10.1f}"
+
+
+class Record:
+    """A single timed phase of a site."""
+
+    __slots__ = ("site", "phase", "thread", "start", "duration", "bytes")
+
+    def __init__(self, site, phase, thread, start):
+        self.site = site
+        self.phase = phase
+        self.thread = thread
+        self.start = start
+        self.duration = 0.0
+        self.bytes = 0
+
+
+class Profiler:
+    """Records timed phases per site."""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def site(self, name):
+        """Attribute all phases within this context (and thread) to site *name*."""
+        previous = getattr(self.local, "site", None)
+        self.local.site = name
+        try:
+            yield
+        finally:
+            self.local.site = previous
+
+    @contextmanager
+    def phase(self, name):
+        """Time the phase *name* of the current site. Yields its `Record`."""
+        record = Record(
+            getattr(self.local, "site", None) or "-",
+            name,
+            threading.get_ident(),
+            time.perf_counter(),
+        )
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - record.start
+            with self.lock:
+                self.records.append(record)
+
+    def summary(self):
+        """
+        Return a list of dicts with the count, total and maximum time and bytes of each
+        site and phase, sorted by total time, longest first.
+        """
+        totals = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0, "bytes": 0})
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            total = totals[(record.site, record.phase)]
+            total["count"] += 1
+            total["total"] += record.duration
+            total["max"] = max(total["max"], record.duration)
+            total["bytes"] += record.bytes
+        return sorted(
+            [
+                {"site": site, "phase": phase, **total}
+                for (site, phase), total in totals.items()
+            ],
+            key=lambda total: total["total"],
+            reverse=True,
+        )
+
+    def table(self):
+        """Return the summary as a plain text table."""
+        return "\n".join(
+            [TABLE_HEADER]
+            + [
+                TABLE_ROW.format(
+                    row["site"][:50],
+                    row["phase"],
+                    row["count"],
+                    row["total"],
+                    row["max"],
+                    row["bytes"] / 1024,
+                )
+                for row in self.summary()
+            ]
+        )
+
+    def chrome_trace(self):
+        """
+        Return all records in the Chrome trace event format, which can be viewed in
+        chrome://tracing or https://ui.perfetto.dev.
+        """
+        with self.lock:
+            records = list(self.records)
+        return json.dumps(
+            {
+                "traceEvents": [
+                    {
+                        "name": record.phase,
+                        "cat": record.site,
+                        "ph": "X",
+                        "ts": (record.start - self.origin) * 1e6,
+                        "dur": record.duration * 1e6,
+                        "pid": 0,
+                        "tid": record.thread,
+                        "args": {"site": record.site, "bytes": record.bytes},
+                    }
+                    for record in records
+                ],
+                "displayTimeUnit": "ms",
+            }
+        )
+
+
+class NullProfiler:
+    """A profiler that records nothing."""
+
+    class NullRecord:
+        __slots__ = ("bytes",)
+
+        def __init__(self):
+            self.bytes = 0
+
+    class NullContext:
+        def __init__(self, record):
+            self.record = record
+
+        def __enter__(self):
+            return self.record
+
+        def __exit__(self, *exc_info):
+            return False
+
+    def __init__(self):
+        self.context = self.NullContext(self.NullRecord())
+
+    def site(self, name):
+        return self.context
+
+    def phase(self, name):
+        return self.context
+
+
+NULL = NullProfiler()
@@ -0,0 +1,184 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+Retrying failed site checks, and skipping sites that keep failing.
+
+`classify()` sorts the errors of a request into kinds: "dns", "tls", "connect",
+"timeout", "rate-limited" and "deadline", and `classify_status()` sorts error responses
+into "server" (5xx) and "client" (4xx) errors, except for 429 and 503, which the
+`fetch.Client` already retried, and are "rate-limited". The crawler adds "content" for
+pages it doesn't recognize. A `RetryPolicy` decides which kinds are worth retrying
+within a run, and how long to wait before, with jittered exponential backoff:
+
+>>> policy = RetryPolicy(retries=2, kinds={"connect", "server"}, backoff=2, factor=3)
+>>> policy.delay("server", 1)  # after the first failed attempt: 2s, minus jitter
+1.43...
+>>> policy.delay("client", 1) is None
+True
+
+A `CircuitBreaker` remembers across runs which sites failed to respond (see
+FAILURE_KINDS) several times in a row. Those are skipped for a cooling-off period, after
+which a single probe is let through. If it fails too, the site is skipped for twice as
+long, until it responds again:
+
+>>> breaker = CircuitBreaker("breakers.db", threshold=3, cooldown=3600)
+>>> breaker.state("https://www.degewo.de/")
+'closed'
+>>> for run in range(3):
+...     breaker.record("https://www.degewo.de/", "timeout")
+3600
+>>> breaker.state("https://www.degewo.de/")
+'open'
+"""
+import socket
+import random
+import sqlite3
+import threading
+import time
+import requests
+import fetch
+
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+# kinds of errors for which the site didn't respond
+FAILURE_KINDS = {"dns", "tls", "connect", "timeout", "server"}
+IGNORED_KINDS = {"rate-limited", "deadline"}  # not the site's fault, or not failing
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def classify(error):
+    """Return the kind of the exception *error* raised by a request, see above."""
+    if isinstance(error, fetch.RateLimited):
+        return "rate-limited"
+    if isinstance(error, fetch.DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(error, requests.exceptions.SSLError):
+        return "tls"
+    cause = error
+    while cause is not None:
+        if isinstance(cause, socket.gaierror):
+            return "dns"
+        cause = getattr(cause, "reason", None) or cause.__cause__ or cause.__context__
+    return "connect"
+
+
+def classify_status(status):
+    """Return the kind of an error response with the HTTP *status*, see above."""
+    if status in fetch.BACK_OFF_STATUS:
+        return "rate-limited"
+    return "server" if status >= 500 else "client"
+
+
+class RetryPolicy:
+    """
+    Retry errors of the given *kinds* up to *retries* times. The first retry waits about
+    *backoff* seconds, each further one *factor* times as long, at most *max_delay*.
+    Delays are jittered by up to half of their length, using *random*.
+    """
+
+    def __init__(
+        self,
+        retries=2,
+        kinds=FAILURE_KINDS,
+        backoff=2,
+        factor=3,
+        max_delay=60,
+        random=random.random,
+    ):
+        self.retries = retries
+        self.kinds = kinds
+        self.backoff = backoff
+        self.factor = factor
+        self.max_delay = max_delay
+        self.random = random
+
+    def delay(self, kind, attempt):
+        """
+        Return the seconds to wait before retrying after *attempt* (counted from 1)
+        failed with an error of *kind*, or None to give up.
+        """
+        if attempt > self.retries or kind not in self.kinds:
+            return None
+        delay = min(self.backoff * self.factor ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.random() / 2)
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures per key (a site's url), persisted to the SQLite database at
+    *path*. After *threshold* failures, the key is open for *cooldown* seconds, then
+    half-open, to let a probe through. Each failed probe opens it again for twice as
+    long, at most *max_cooldown*. *clock* defaults to `time.time()`.
+    """
+
+    def __init__(
+        self, path, threshold=3, cooldown=3600, max_cooldown=86400, clock=time.time
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS breakers (key TEXT PRIMARY KEY,"
+                " failures INTEGER, until REAL, cooldown REAL)"
+            )
+
+    def state(self, key):
+        """Return whether *key* is CLOSED, OPEN or HALF_OPEN."""
+        until = self.until(key)
+        if until is None:
+            return CLOSED
+        return OPEN if self.clock() < until else HALF_OPEN
+
+    def until(self, key):
+        """Return the unix time until which *key* is open, or None if it's closed."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT until FROM breakers WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, key, kind):
+        """
+        Record the outcome of a check of *key*: None if it succeeded, else the kind of
+        its error. Kinds in FAILURE_KINDS count as failures, those in IGNORED_KINDS
+        change nothing, any other closes *key* like a success, as the site responded.
+        Returns the cooling-off period in seconds if *key* is opened, else None.
+        """
+        if kind in IGNORED_KINDS:
+            return None
+        with self.lock, self.db:
+            if kind not in FAILURE_KINDS:
+                self.db.execute("DELETE FROM breakers WHERE key = ?", (key,))
+                return None
+            row = self.db.execute(
+                "SELECT failures, cooldown FROM breakers WHERE key = ?", (key,)
+            ).fetchone()
+            failures, cooldown = row or (0, None)
+            failures += 1
+            until = None
+            if failures >= self.threshold:
+                cooldown = (
+                    self.cooldown
+                    if cooldown is None
+                    else min(cooldown * 2, self.max_cooldown)
+                )
+                until = self.clock() + cooldown
+            self.db.execute(
+                "INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?)",
+                (key, failures, until, cooldown),
+            )
+        return cooldown if until is not None else None
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,149 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+A small in-process scheduler, running tasks on individual intervals.
+
+Each task is identified by a key. `schedule()` sets when it is due next, randomly
+shifted by up to *jitter* times the interval, so that checks of different sites don't
+line up. `wait()` blocks until at least one task is due and returns all due keys. Tasks
+may be rescheduled from other threads while `wait()` is blocking.
+
+>>> tasks = Scheduler(jitter=0.1)
+>>> tasks.schedule("DeGeWo", 0)
+>>> for key in tasks.wait():
+...     check(key)
+...     tasks.schedule(key, 600)
+
+`ChangeHistory` records when each site's content changed, and `adaptive_interval()`
+derives a polling interval from that, so that busy sites are checked more often than
+quiet ones.
+"""
+import heapq
+import random
+import sqlite3
+import threading
+import time
+
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+
+
+class Scheduler:
+    """
+    Keeps track of when each task is due. *clock* defaults to `time.monotonic()`.
+    """
+
+    def __init__(self, jitter=0.0, clock=time.monotonic):
+        self.jitter = jitter
+        self.clock = clock
+        self.queue = []
+        self.due_times = {}
+        self.condition = threading.Condition()
+
+    def schedule(self, key, interval):
+        """Make task *key* due in *interval* seconds (plus or minus jitter)."""
+        delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+        with self.condition:
+            due_time = self.clock() + max(0, delay)
+            self.due_times[key] = due_time
+            heapq.heappush(self.queue, (due_time, id(key), key))
+            self.condition.notify_all()
+
+    def unschedule(self, key):
+        """Remove task *key*, it won't be returned by `wait()` until rescheduled."""
+        with self.condition:
+            self.due_times.pop(key, None)
+
+    def next_due(self):
+        """Return the time the next task is due, or None if there are no tasks."""
+        with self.condition:
+            self._drop_stale()
+            return self.queue[0][0] if self.queue else None
+
+    def wait(self):
+        """
+        Block until at least one task is due, then return the keys of all due tasks.
+        They are not due again until they are rescheduled.
+        """
+        with self.condition:
+            while True:
+                next_due = self.next_due()
+                now = self.clock()
+                if next_due is not None and next_due <= now:
+                    break
+                self.condition.wait(None if next_due is None else next_due - now)
+            due = []
+            while self.next_due() is not None and self.queue[0][0] <= now:
+                _, _, key = heapq.heappop(self.queue)
+                del self.due_times[key]
+                due.append(key)
+            return due
+
+    def _drop_stale(self):
+        """Drop queue entries that were superseded by a later `schedule()` call."""
+        while self.queue and self.due_times.get(self.queue[0][2]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+
+
+class ChangeHistory:
+    """
+    When each site's content last changed, persisted to the SQLite database at
+    *path*. Only the last *keep* changes per site are kept.
+    """
+
+    def __init__(self, path, keep=20):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path), timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS changes (site TEXT, time REAL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS changes_site ON changes (site, time)"
+            )
+
+    def record(self, site, when=None):
+        """Record a change of *site* at the unix time *when* (default now)."""
+        when = time.time() if when is None else when
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO changes VALUES (?, ?)", (site, when))
+            self.db.execute(
+                "DELETE FROM changes WHERE site = ? AND time NOT IN"
+                " (SELECT time FROM changes WHERE site = ? ORDER BY time DESC LIMIT ?)",
+                (site, site, self.keep),
+            )
+
+    def recent(self, site):
+        """Return the unix times of the recorded changes of *site*, oldest first."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT time FROM changes WHERE site = ? ORDER BY time", (site,)
+            ).fetchall()
+        return [when for (when,) in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def adaptive_interval(
+    changes, now, default, min_interval, max_interval, boost=0, polls_per_change=4
+):
+    """
+    Return how long to wait before checking a site again, given the unix times of its
+    recent *changes*. Within *boost* seconds after a change, poll at *min_interval*, as
+    more offers tend to follow. Otherwise poll *polls_per_change* times per average time
+    between changes, where the time since the last change counts as well, so that sites
+    slow down the longer they stay quiet. Without at least two known changes, use
+    *default*. The result is always within *min_interval* and *max_interval*.
+    """
+    if changes and now - changes[-1] < boost:
+        return min_interval
+    if len(changes) < 2:
+        interval = default
+    else:
+        gaps = [later - earlier for earlier, later in zip(changes, changes[1:])]
+        gaps.append(now - changes[-1])
+        interval = sum(gaps) / len(gaps) / polls_per_change
+    return min(max(interval, min_interval), max_interval)
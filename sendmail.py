@@ -35,6 +35,14 @@ You can send blind copies (BCC) to a list of email addresses:
 The send() function returns False if something went wrong, and errors will be
 printed to stdout.
 
+To send several emails over the same connection, use a Connection. It logs in on first
+use, and reconnects if the server dropped the connection in between:
+
+>>> connection = Connection()
+>>> mail = Mail('recipient@example.com', 'subject', 'hello')
+>>> connection.send(mail.recipients(), str(mail))
+>>> connection.close()
+
 TODO: make an error field in Mail and fill that with errors instead of
 printing.
 """
@@ -99,12 +107,8 @@ class Mail(object):
             True on successful send, False on failure.
         """
         tries = 0
-        to = [self.email["address"]]
+        to = self.recipients()
         if self.bcc:
-            try:
-                to = to + self.bcc
-            except TypeError:
-                to += [self.bcc]
             print(to)
         if self.email["address"]:
             success = False
@@ -149,5 +153,55 @@ class Mail(object):
             print("No mail adresses given, no mails sent.")
             return True
 
+    def recipients(self):
+        """Return the list of all recipient addresses, including BCC."""
+        to = [self.email["address"]]
+        if self.bcc:
+            try:
+                to = to + self.bcc
+            except TypeError:
+                to += [self.bcc]
+        return to
+
     def __str__(self):
         return self.email["msg"].as_string()
+
+
+class Connection(object):
+    """A persistent, logged in connection to the configured SMTP server."""
+
+    def __init__(self):
+        self.smtpserver = None
+
+    def connect(self):
+        self.close()
+        self.smtpserver = smtplib.SMTP(MailConfig.server)
+        self.smtpserver.ehlo()
+        self.smtpserver.starttls()
+        self.smtpserver.ehlo()
+        self.smtpserver.login(MailConfig.user, MailConfig.password)
+
+    def send(self, to, message):
+        """
+        Send the *message* string to the list of addresses *to*, connecting first if
+        necessary. If the server dropped the connection, reconnects once.
+
+        Raises:
+            smtplib.SMTPException or OSError if sending failed.
+        """
+        if self.smtpserver is None:
+            self.connect()
+        try:
+            self.smtpserver.sendmail(MailConfig.user, to, message)
+        except smtplib.SMTPServerDisconnected:
+            self.connect()
+            self.smtpserver.sendmail(MailConfig.user, to, message)
+
+    def close(self):
+        if self.smtpserver is None:
+            return
+        try:
+            self.smtpserver.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtpserver.close()
+        self.smtpserver = None
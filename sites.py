@@ -10,16 +10,55 @@ none-str: a string that appears in the website html in case nothing has been fou
 success-str: a string that appears in the website html in case something has been found.
 expose-url-pattern: regex for links that point to offer exposés and should be sent out
     via email.
+fingerprint-start, fingerprint-end: for sites without success-str, strings that enclose
+    the part of the website html whose text is compared to the last check, to ignore
+    changing banners, dates etc. elsewhere on the page. Without them, the text of the
+    whole page is compared, as it is if they aren't found. Starting at none-str and
+    ending at the next tag ("</"), only a change from "nothing found" is noticed.
+list-end-str: a string that appears in the website html after the last exposé link. When
+    streaming, reading the page stops there.
+stream: whether to stop reading the website as soon as none-str or success-str (and
+    list-end-str) have been found (default: STREAM_LISTINGS in crawler.py). Assumes that
+    none-str and success-str never appear on the same page. Pages read only partially
+    are recognized as unchanged by their ETag/Last-Modified headers only, not by their
+    content, and only the part read is archived in snapshots/.
+connect-timeout, read-timeout: seconds to wait for a connection to the site, and for
+    each read from it (default: CONNECT_TIMEOUT and READ_TIMEOUT in crawler.py).
+page-url: url of the following listing pages, with "{page}" in place of the page
+    number (2, 3, ...). Further pages are only checked if the first one changed since
+    the last check, so it should show something that changes with any offer, like the
+    number of results.
+next-page-pattern: regex for the link to the next listing page, instead of page-url.
+page-count-pattern: regex for the number of listing pages on the first one. If found,
+    pages from page-url are retrieved at the same time instead of one after another.
+page-size: offers per listing page. If given, page-count-pattern matches the total
+    number of offers instead of pages.
+max-pages: maximum number of listing pages checked (default: MAX_PAGES in crawler.py).
+newest-first: whether the listing shows the newest offers first. If so, no further
+    pages are checked after one without new offers.
+interval: seconds between checks in daemon mode (default: CHECK_INTERVAL in crawler.py).
+interval-min, interval-max: bounds for adapting the interval in daemon mode to how often
+    new offers show up (default: MIN_INTERVAL and MAX_INTERVAL in crawler.py).
 notes: general notes on the site (currently not used).
 expose-details: a mapping from keys to regex strings, used to extract further details
-    from an exposé page.
+    from an exposé page. The values of the keys price, total_rent, area, rooms, floor
+    and wbs are checked against the criteria in config.py, offers that don't match
+    aren't sent (see FILTER_OFFERS in crawler.py).
+listing-details: like expose-details, but extracted from each offer's entry on the
+    listing page, so that offers that don't match the criteria are skipped before their
+    exposé is retrieved.
+listing-entry-str: a string that starts each offer's entry on the listing page, for
+    listing-details. Without it, an entry reaches from its exposé link to the next one.
 """
+degewo_search = f"https://immosuche.degewo.de/de/search?size=10&page={{page}}&property_type_id=1&categories%5B%5D=1&lat=&lon=&area=&address%5Bstreet%5D=&address%5Bcity%5D=&address%5Bzipcode%5D=&address%5Bdistrict%5D=&district={degewo_districts}&property_number=&price_switch=true&price_radio=custom&price_from=&price_to={rent_max}&qm_radio=custom&qm_from={area_min}&qm_to={area_max}&rooms_radio=custom&rooms_from={rooms_min}&rooms_to={rooms_max}&wbs_required={'true' if wbs else 'false'}&order=rent_total_without_vat_asc"
 sites = [
     {
         "name": "Wohnungsbaugenossenschaft DPF eG",
         "url": "https://www.dpfonline.de/interessenten/immobilien/",
         "success-str": '<div class="immo-a-info">',
         "expose-url-pattern": r'<a href="https://www\.dpfonline\.de/(immobilien/.+?)/">',
+        "listing-entry-str": '<div class="immo-a-info">',
+        "listing-details": {"rooms": r"<h3>([0-9,]+) Zimmer"},
         "expose-details": {
             "title": r'<h1 class="immo-caption">\s+?(.+?)\s+?</h1>',
             "price": r"<td>Kaltmiete</td>\s+?<td>\s+?(.+?)\s+?</td>",
@@ -36,6 +75,8 @@ sites = [
         "name": "Bau- und Siedlungsgenossenschaft Postheimstätte eG",
         "url": "https://www.postheimstätte.de/properties/",
         "none-str": "Es tut uns leid, es wurden keine Objekte gefunden.",
+        "fingerprint-start": "Es tut uns leid, es wurden keine Objekte gefunden.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Wohnungsbaugenossenschaft Zentrum eG",
@@ -47,26 +88,36 @@ sites = [
         "name": "Wohnungsbaugenossenschaft Altglienicke eG",
         "url": "https://www.wg-altglienicke.de/wohnungen",
         "none-str": "Zur Zeit stehen keine Wohnungsangebote zur Verfügung.",
+        "fingerprint-start": "Zur Zeit stehen keine Wohnungsangebote zur Verfügung.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Wohnungsbaugenossenschaft Solidarität eG",
         "url": "https://wg-solidaritaet.de/wohnen/mietangebote/",
         "none-str": "Aktuell stehen leider keine Mietangebote zur Verfügung.",
+        "fingerprint-start": "Aktuell stehen leider keine Mietangebote zur Verfügung.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Wohnungsbaugenossenschaft Bremer Höhe eG",
         "url": "https://www.bremer-hoehe.de/Vermietung:_:90.html?sub=1",
         "none-str": "Leider liegen zur Zeit keine Vermietungsangebote vor.",
+        "fingerprint-start": "Leider liegen zur Zeit keine Vermietungsangebote vor.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Beamten-Wohnungs-Verein zu Berlin eG",
         "url": "https://www.bwv-berlin.de/wohnungsangebote.html",
         "none-str": "Derzeit können wir Ihnen leider keine Wohnungen zur Vermietung anbieten.",
+        "fingerprint-start": "Derzeit können wir Ihnen leider keine Wohnungen zur Vermietung anbieten.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Bewohnergenossenschaft FriedrichsHeim eG",
         "url": "https://www.friedrichsheim-eg.de/category/freie-wohnungen/",
         "none-str": "Zur Zeit sind leider keine Wohnungen im Angebot.",
+        "fingerprint-start": "Zur Zeit sind leider keine Wohnungen im Angebot.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Gewobag",
@@ -98,6 +149,8 @@ sites = [
         "name": "Habitat e.G.",
         "url": "http://www.habitat-eg.de/index/110/",
         "none-str": "Derzeit können wir Ihnen leider&nbsp;keine freien Wohnungen anbieten.",
+        "fingerprint-start": "Derzeit können wir Ihnen leider&nbsp;keine freien Wohnungen anbieten.",
+        "fingerprint-end": "</",
     },
     {
         "name": "Gesobau",
@@ -115,8 +168,13 @@ sites = [
     },
     {
         "name": "DeGeWo",
-        "url": f"https://immosuche.degewo.de/de/search?size=10&page=1&property_type_id=1&categories%5B%5D=1&lat=&lon=&area=&address%5Bstreet%5D=&address%5Bcity%5D=&address%5Bzipcode%5D=&address%5Bdistrict%5D=&district={degewo_districts}&property_number=&price_switch=true&price_radio=custom&price_from=&price_to={rent_max}&qm_radio=custom&qm_from={area_min}&qm_to={area_max}&rooms_radio=custom&rooms_from={rooms_min}&rooms_to={rooms_max}&wbs_required={'true' if wbs else 'false'}&order=rent_total_without_vat_asc",
+        "url": degewo_search.format(page=1),
+        "page-url": degewo_search,
+        "page-count-pattern": "<span class='count'>([0-9.]+)</span>",
+        "page-size": 10,
         "none-str": "0</span>\n Treffer anzeigen",
+        # none-str also matches "10 Treffer", so the whole page has to be read
+        "stream": False,
         "success-str": "<div class='merken merken__article-list js-merken' data-objectid=",
         "expose-url-pattern": r'href="(/de/properties/W[0-9-]+?)"><div class=\'article-list__image',
         "expose-details": {
@@ -161,6 +219,8 @@ sites = [
         "name": "Berolina",
         "url": "https://berolina.info/wohnungsangebote-wenn-angebote-vorhanden/",
         "none-str": "Momentan sind leider keine Immobilien in unserem Angebot verfügbar.",
+        "fingerprint-start": "Momentan sind leider keine Immobilien in unserem Angebot verfügbar.",
+        "fingerprint-end": "</",
     },
     # {
     #     "name": "ebay Kleinanzeigen",
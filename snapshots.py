@@ -0,0 +1,202 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+A compressed, content-addressed archive of the pages retrieved during crawls.
+
+Each page body is stored once, gzip-compressed, under the SHA-256 hash of its text in
+`objects/`, so unchanged pages don't take up any extra space. Each crawl saves a
+snapshot manifest, mapping the urls retrieved during the crawl to their status code and
+body, as far as it was read (streamed listing pages are only read up to their markers,
+see `stream` in sites.py). Replaying a snapshot serves the newest version of each page
+as of that snapshot, so pages that weren't retrieved again in that crawl are still
+available. Only the newest *keep* snapshots are kept: once there are PRUNE_SLACK more,
+the oldest are deleted, along with the objects no longer referenced by any of the rest.
+Objects written or recorded within OBJECT_GRACE are kept, as they may belong to a
+snapshot that another process (e.g. a worker, or the daemon) hasn't saved yet.
+
+>>> archive = Archive("snapshots")
+>>> archive.record(url, response.status_code, response.text)
+>>> archive.save()
+'20201017-120000-000000'
+
+A `ReplayClient` serves the pages of a snapshot instead of the network, with the same
+interface as :py:class:`fetch.Client`:
+
+>>> client = ReplayClient(archive, "latest")
+>>> client.get(url).text
+"""
+import io
+import os
+import gzip
+import json
+import time
+import threading
+from hashlib import sha256
+from datetime import datetime
+from pathlib import Path
+import requests
+
+ENCODING = "utf-8"
+PRUNE_SLACK = 0.1  # fraction of *keep* by which the snapshots may grow before pruning
+OBJECT_GRACE = 24 * 60 * 60  # seconds that new objects are kept, even if unreferenced
+
+
+class Archive:
+    """A snapshot archive in the directory *path*, keeping *keep* snapshots."""
+
+    def __init__(self, path, keep=500):
+        self.path = Path(path)
+        self.objects_path = self.path / "objects"
+        self.keep = keep
+        self.pending = {}
+        self.last_pages = None
+        self.lock = threading.Lock()
+
+    def record(self, url, status, text):
+        """Record the page *url* with its *status* code and *text* for the next save."""
+        body = text.encode(ENCODING)
+        digest = sha256(body).hexdigest()
+        object_path = self.object_path(digest)
+        try:
+            os.utime(object_path)  # not pruned within OBJECT_GRACE, see prune()
+        except FileNotFoundError:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(object_path, gzip.compress(body))
+        with self.lock:
+            self.pending[url] = {"status": status, "object": digest}
+
+    def record_unchanged(self, url):
+        """
+        Record the page *url* as unchanged since it was last recorded (e.g. after a
+        "304 Not Modified" response). Does nothing if it was never recorded.
+        """
+        with self.lock:
+            if self.last_pages is None:
+                snapshots = self.snapshots()
+                self.last_pages = self.pages_at(snapshots[-1]) if snapshots else {}
+            page = self.pending.get(url) or self.last_pages.get(url)
+            if page is None:
+                return
+            try:
+                os.utime(self.object_path(page["object"]))
+            except FileNotFoundError:
+                return
+            self.pending[url] = page
+
+    def save(self):
+        """
+        Save all pages recorded since the last save as a new snapshot, and return its
+        name. Returns None if nothing was recorded.
+        """
+        with self.lock:
+            pages, self.pending = self.pending, {}
+            if self.last_pages is not None:
+                self.last_pages.update(pages)
+        if not pages:
+            return None
+        name = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.path.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.path / f"{name}.json", json.dumps(pages).encode())
+        self.prune()
+        return name
+
+    def snapshots(self):
+        """Return the names of all snapshots, oldest first."""
+        return sorted(path.stem for path in self.path.glob("*.json"))
+
+    def load(self, name):
+        """
+        Return the pages of snapshot *name*, as a dict of urls to dicts with `status`
+        and `object` keys.
+        """
+        with (self.path / f"{name}.json").open() as manifest:
+            return json.load(manifest)
+
+    def pages_at(self, name):
+        """
+        Return the newest recorded version of every page as of snapshot *name* (or the
+        newest snapshot for "latest"), like `load()`. This includes pages that weren't
+        retrieved in that crawl itself, like exposés that were already known.
+        """
+        snapshots = self.snapshots()
+        if name == "latest":
+            if not snapshots:
+                raise FileNotFoundError(f"no snapshots in {self.path}")
+            name = snapshots[-1]
+        elif name not in snapshots:
+            raise FileNotFoundError(f"no snapshot {name} in {self.path}")
+        pages = {}
+        for snapshot in snapshots[: snapshots.index(name) + 1]:
+            pages.update(self.load(snapshot))
+        return pages
+
+    def body(self, digest):
+        """Return the text of the object *digest*."""
+        return gzip.decompress(self.object_path(digest).read_bytes()).decode(ENCODING)
+
+    def object_path(self, digest):
+        return self.objects_path / digest[:2] / f"{digest}.gz"
+
+    def prune(self):
+        """
+        Delete all but the newest `keep` snapshots once there are PRUNE_SLACK more, and
+        the objects they no longer reference, except new ones, see above. Other
+        processes may prune at the same time.
+        """
+        snapshots = self.snapshots()
+        if len(snapshots) <= self.keep + int(self.keep * PRUNE_SLACK):
+            return
+        for name in snapshots[: -self.keep]:
+            try:
+                (self.path / f"{name}.json").unlink()
+            except FileNotFoundError:
+                pass
+        referenced = set()
+        for name in snapshots[-self.keep :]:
+            try:
+                referenced.update(page["object"] for page in self.load(name).values())
+            except FileNotFoundError:
+                pass
+        cutoff = time.time() - OBJECT_GRACE
+        for object_path in self.objects_path.glob("*/*.gz"):
+            if object_path.name[: -len(".gz")] in referenced:
+                continue
+            try:
+                if object_path.stat().st_mtime < cutoff:
+                    object_path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ReplayClient:
+    """Serves the pages of snapshot *name* in *archive* like a `fetch.Client`."""
+
+    def __init__(self, archive, name):
+        self.archive = archive
+        self.pages = archive.pages_at(name)
+
+    def get(self, url, **kwargs):
+        """
+        Return a `requests.Response` for *url* from the snapshot. Raises a
+        `requests.exceptions.ConnectionError` if *url* isn't in the snapshot.
+        """
+        page = self.pages.get(url)
+        if page is None:
+            raise requests.exceptions.ConnectionError(f"{url} not in snapshot")
+        response = requests.Response()
+        response.url = url
+        response.status_code = page["status"]
+        response.encoding = ENCODING
+        response.raw = io.BytesIO(self.archive.body(page["object"]).encode(ENCODING))
+        return response
+
+    def close(self):
+        pass
+
+
+def write_atomic(path, data):
+    """Write the bytes *data* to *path*, so that readers never see a partial file."""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
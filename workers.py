@@ -0,0 +1,185 @@
+# CC0 - free software.
+# To the extent possible under law, all copyright and related or neighboring
+# rights to this work are waived.
+"""
+A work queue for crawling in several worker processes.
+
+A coordinator splits the sites of a run into shards with `shard()`, by a hash of their
+host, so that all requests to a host come from the same worker, and its politeness
+limits still apply. The shards are submitted as tasks to a `WorkQueue`, a SQLite
+database that any number of workers take tasks from, on the same machine or on others
+sharing its directory. Workers post a result for each site as it is done, which the
+coordinator collects as they come in:
+
+>>> queue = WorkQueue("work.db")
+>>> run = queue.submit_run([{"sites": [...]}, {"sites": [...]}])
+>>> task = queue.take("worker-1")  # in a worker
+>>> queue.post(task.id, {"name": "DeGeWo", ...})
+>>> queue.finish(task.id)
+>>> queue.results(run)  # in the coordinator
+[(1, {'name': 'DeGeWo', ...})]
+>>> queue.unfinished(run)
+[{'sites': [...]}]
+"""
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from hashlib import sha1
+from urllib.parse import urlsplit
+
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+
+
+class Task:
+    """A task taken from the queue: its *id*, *run* and *payload* dict."""
+
+    __slots__ = ("id", "run", "payload")
+
+    def __init__(self, id, run, payload):
+        self.id = id
+        self.run = run
+        self.payload = payload
+
+
+class WorkQueue:
+    """
+    Tasks and their results, in the SQLite database at *path*. Each task is taken by
+    one worker only. *clock* defaults to `time.time()`.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(path),
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, run TEXT,"
+            " payload TEXT, worker TEXT, taken REAL, finished INTEGER DEFAULT 0)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results"
+            " (id INTEGER PRIMARY KEY, run TEXT, task INTEGER, payload TEXT)"
+        )
+
+    def submit_run(self, payloads):
+        """Submit a task for each of the *payloads* dicts, return the new run's id."""
+        run = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    "INSERT INTO tasks (run, payload) VALUES (?, ?)",
+                    [(run, json.dumps(payload)) for payload in payloads],
+                )
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+        return run
+
+    def take(self, worker):
+        """Take the oldest task nobody took yet for *worker*, or return None."""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, run, payload FROM tasks WHERE worker IS NULL"
+                    " ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        "UPDATE tasks SET worker = ?, taken = ? WHERE id = ?",
+                        (worker, self.clock(), row[0]),
+                    )
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+        if row is None:
+            return None
+        task_id, run, payload = row
+        return Task(task_id, run, json.loads(payload))
+
+    def post(self, task_id, payload):
+        """Post a result *payload* dict of the task *task_id*."""
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO results (run, task, payload)"
+                " SELECT run, id, ? FROM tasks WHERE id = ?",
+                (json.dumps(payload), task_id),
+            )
+
+    def finish(self, task_id):
+        """Mark the task *task_id* as finished, after all its results were posted."""
+        with self.lock:
+            self.db.execute("UPDATE tasks SET finished = 1 WHERE id = ?", (task_id,))
+
+    def results(self, run, after=0):
+        """
+        Return the results of *run* posted after the result id *after*, as a list of
+        (result id, payload dict), oldest first.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, payload FROM results WHERE run = ? AND id > ? ORDER BY id",
+                (run, after),
+            ).fetchall()
+        return [(result_id, json.loads(payload)) for result_id, payload in rows]
+
+    def unfinished(self, run):
+        """Return the payloads of the tasks of *run* that aren't finished yet."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT payload FROM tasks WHERE run = ? AND NOT finished", (run,)
+            ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def untaken(self, run):
+        """
+        Return the payloads of the unfinished tasks of *run* that no worker took, or
+        that were requeued since, see `requeue_stale()`.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT payload FROM tasks"
+                " WHERE run = ? AND NOT finished AND worker IS NULL",
+                (run,),
+            ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def requeue_stale(self, run, timeout):
+        """
+        Make the tasks of *run* that were taken more than *timeout* seconds ago, but
+        aren't finished, available again (e.g. if their worker died). Results posted so
+        far are kept, so the coordinator has to skip repeated ones. Returns the number
+        of requeued tasks.
+        """
+        with self.lock:
+            return self.db.execute(
+                "UPDATE tasks SET worker = NULL, taken = NULL"
+                " WHERE run = ? AND NOT finished AND taken < ?",
+                (run, self.clock() - timeout),
+            ).rowcount
+
+    def clear(self, run):
+        """Delete all tasks and results of *run*."""
+        with self.lock:
+            self.db.execute("DELETE FROM results WHERE run = ?", (run,))
+            self.db.execute("DELETE FROM tasks WHERE run = ?", (run,))
+
+    def close(self):
+        self.db.close()
+
+
+def shard(url, shards):
+    """Return the shard (0 to *shards* - 1) of *url*, the same for urls of a host."""
+    host = urlsplit(url).netloc.lower()
+    return int(sha1(host.encode()).hexdigest(), 16) % shards